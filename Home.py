@@ -1,4 +1,3 @@
-import time
 import streamlit as st
 
 st.set_page_config(
@@ -1,21 +1,10 @@
 import streamlit as st
-import json
-from langchain.document_loaders import UnstructuredFileLoader
-from langchain.text_splitter import CharacterTextSplitter
-from langchain.chat_models import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from langchain.callbacks import StreamingStdOutCallbackHandler, get_openai_callback
-from langchain.retrievers import WikipediaRetriever
-from langchain.schema import BaseOutputParser
+from utils.quiz import generate_quiz, get_quiz_cache, quiz_key
+from utils.wiki import LocalWikipediaRetriever
 
 
-
-class JsonOutputParser(BaseOutputParser):
-    def parse(self, text):
-        text = text.replace("```json", "").replace("```", "")
-        return json.loads(text)
-    
-output_parser = JsonOutputParser()
+# 프롬프트나 모델 바꾸면 같이 올려야 예전 퀴즈가 안나옴
+QUIZ_VERSION = "gpt-3.5-turbo-1106:function-call:v1"
 
 
 
@@ -66,48 +55,63 @@ function = {
 }
 
 
-llm = ChatOpenAI(
-    temperature=0.1,
-    model="gpt-3.5-turbo-1106",
-    streaming=True,
-    callbacks=[StreamingStdOutCallbackHandler()],
-).bind(
-    function_call={
-        "name": "create_quiz",
-    },
-    functions=[
-        function,
-    ],
-)
-
-
 ### Stuff라 이부분이 필요없을거같긴한데.. MapReduce를 위해 남겨두자...
 def format_docs(docs):
     return "\n\n".join(document.page_content for document in docs)
 
 
+# function calling은 JSON이 content가 아니라 function_call arguments로 조금씩 옴
+def function_arguments(message):
+    return message.additional_kwargs.get("function_call", {}).get("arguments", "")
+
+
+# llm, 프롬프트, 체인은 프로세스에 하나씩만 만들어서 세션끼리 공유 (rerun마다 새로 안만듦)
+@st.cache_resource
+def get_chains():
+    from langchain.chat_models import ChatOpenAI
+    from langchain.prompts import ChatPromptTemplate
+    from langchain.callbacks import StreamingStdOutCallbackHandler
 
-question_prompt = ChatPromptTemplate.from_messages(
-        [
-            (
-                "system",
-                """
-                    You are a helpful assistant that is role playing as a teacher.
+    llm = ChatOpenAI(
+        temperature=0.1,
+        model="gpt-3.5-turbo-1106",
+        streaming=True,
+        callbacks=[StreamingStdOutCallbackHandler()],
+    ).bind(
+        function_call={
+            "name": "create_quiz",
+        },
+        functions=[
+            function,
+        ],
+    )
+
+    question_prompt = ChatPromptTemplate.from_messages(
+            [
+                (
+                    "system",
+                    """
+                        You are a helpful assistant that is role playing as a teacher.
                         
-                    Based ONLY on the following context make 5 questions to test the user's knowledge about the text.
+                        Based ONLY on the following context make 5 questions to test the user's knowledge about the text.
                     
-                    Each question should have 4 answers, three of them must be incorrect and one should be correct.
-                    Context: {context}
-                """,
-            )
-        ]
-    )
+                        Each question should have 4 answers, three of them must be incorrect and one should be correct.
+                        Context: {context}
+                    """,
+                )
+            ]
+        )
+
+    question_chain = {"context": format_docs} | question_prompt | llm
+    return question_chain
 
-question_chain = {"context": format_docs} | question_prompt | llm
 
 
 @st.cache_data(show_spinner="Loading file...")
 def split_file(file):
+    from langchain.document_loaders import UnstructuredFileLoader
+    from langchain.text_splitter import CharacterTextSplitter
+
     file_content = file.read()
     file_path = f"./.cache/quiz_files/{file.name}"
     with open(file_path, "wb") as f:
@@ -121,15 +125,26 @@ def split_file(file):
     docs = loader.load_and_split(text_splitter=splitter)
     return docs
 
-@st.cache_data(show_spinner="Making Quiz...")
-### retriever의 리턴값 document가 content, metadata등이 포함된 구조라 해시가 불가능 -> docs가 바뀌어도 실행안됨
-def final_chain(_docs, topic):
-    chain = question_chain | (lambda x: x.additional_kwargs["function_call"]["arguments"]) | output_parser
-    return chain.invoke(_docs)
+# 문서 내용 해시로 디스크 캐시를 먼저 찾고, 없을때만 LLM 호출 (llm도 그때 get_chains()로 만듦)
+# 스트리밍하면서 질문이 하나 완성될때마다 바로 내보내고 다 끝나면 캐시에 넣음
+def final_chain(docs):
+    quiz_cache = get_quiz_cache()
+    key = quiz_key(docs, QUIZ_VERSION)
+    quiz = quiz_cache.get(key)
+    if quiz is not None:
+        yield from quiz["questions"]
+        return
+    questions = []
+    for question in generate_quiz(get_chains(), docs, function_arguments):
+        questions.append(question)
+        yield question
+    if questions:
+        quiz_cache.set(key, {"questions": questions})
 
 @st.cache_data(show_spinner="Searching Wikipedia...")
 def search_wiki(topic):
-    retriever = WikipediaRetriever(top_k_results=2)
+    # 로컬 덤프 인덱스(python -m utils.wiki)에서 먼저 찾고 없으면 인터넷 위키피디아
+    retriever = LocalWikipediaRetriever(top_k_results=2)
     docs = retriever.get_relevant_documents(topic)
     return docs
 
@@ -168,18 +183,19 @@ if not docs:
     """
     )
 else:
-    response = final_chain(docs, topic if topic else file.name)
     with st.form(key="question_form"):
-        for a in response["questions"]:
-            st.write(a["question"])
-            ## 빈리스트 안만들고 append까지
-            value = st.radio(
-                "Select an option", 
-                [answer["answer"] for answer in a["answers"]],
-                index=None, ## -> 기본값으로 아무것도 선택안되게
-            )
-            if ({"answer": value, "correct": True} in a["answers"]):
-                st.success("Correct!")
-            elif value is not None: 
-                st.error("Incorrect!")    
+        with st.spinner("Making Quiz..."):
+            for i, a in enumerate(final_chain(docs)):
+                st.write(a["question"])
+                ## 빈리스트 안만들고 append까지
+                value = st.radio(
+                    "Select an option", 
+                    [answer["answer"] for answer in a["answers"]],
+                    index=None, ## -> 기본값으로 아무것도 선택안되게
+                    key=f"question_{i}",
+                )
+                if ({"answer": value, "correct": True} in a["answers"]):
+                    st.success("Correct!")
+                elif value is not None: 
+                    st.error("Incorrect!")    
         button = st.form_submit_button("Submit")
@@ -1,15 +1,12 @@
-import time
 import streamlit as st
-from langchain.chat_models import ChatOpenAI
-from langchain.document_loaders import UnstructuredFileLoader
-from langchain.text_splitter import CharacterTextSplitter
-from langchain.embeddings import OpenAIEmbeddings, CacheBackedEmbeddings
-from langchain.vectorstores import Chroma, FAISS
-from langchain.storage import LocalFileStore
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.schema.runnable import RunnablePassthrough, RunnableLambda
-from langchain.callbacks.base import BaseCallbackHandler
-from langchain.memory import ConversationBufferMemory
+from utils.chat import ChatCallbackHandler, answer_cache, replay, stream_tokens
+from utils.chains import build_rag_chain
+from utils.index import combine_hashes, load_or_build_index
+from utils.memory import SummaryWindowMemory
+from utils.ingest import save_upload, iter_split_files, build_index
+from utils.registry import register
+from utils.runner import iterate
+from utils.stores import cache_embeddings
 
 
 st.set_page_config(
@@ -18,47 +15,62 @@ st.set_page_config(
 )
 
 
-class ChatCallbackHandler(BaseCallbackHandler):
-    message = ""
-    def on_llm_start(self, *args, **kwargs):
-        self.message_box = st.empty()
+chat_handler = ChatCallbackHandler(on_end=lambda message: save_message(message, "ai"))
 
-    def on_llm_end(self, *args, **kwargs):
-        save_message(self.message, "ai")
+# llm, 프롬프트, 체인은 프로세스에 하나씩만 만들어서 세션끼리 공유 (rerun마다 새로 안만듦)
+@st.cache_resource
+def get_chain():
+    from langchain.chat_models import ChatOpenAI
 
-    def on_llm_new_token(self, token, *args, **kwargs):
-        self.message += token 
-        self.message_box.markdown(self.message)
+    llm = ChatOpenAI(
+        temperature=0.1,
+        streaming=True,
+    )
+    return build_rag_chain(llm)
+
+
+@st.cache_resource
+def get_query_embedder():
+    from langchain.embeddings import OpenAIEmbeddings
+
+    return OpenAIEmbeddings()
 
-llm = ChatOpenAI(
-    temperature=0.1,
-    streaming=True,
-    callbacks=[ChatCallbackHandler()],
-)
+
+@st.cache_resource
+def get_summary_llm():
+    from langchain.chat_models import ChatOpenAI
+
+    return ChatOpenAI(temperature=0.1)
 
 
 # 파일첨부시에만 load, split, embed, store, retrive함
 @st.cache_data(show_spinner="I'm embedding you")
-def embed_file(file):
-    file_content = file.read()
-    file_path = f"./.cache/files/{file.name}"
-    with open(file_path, "wb") as f:
-        f.write(file_content)
+def embed_file(files):
+    from langchain.embeddings import OpenAIEmbeddings
+
+    file_paths, file_hashes = zip(*[save_upload(file, "./.cache/files") for file in files])
+    file_hash = combine_hashes(file_hashes)
 
-    splitter = CharacterTextSplitter.from_tiktoken_encoder( 
+    splitter_kwargs = dict(
         separator="\n",
         chunk_size=600,
         chunk_overlap=100
     )
-    loader = UnstructuredFileLoader(file_path)
-    docs = loader.load_and_split(text_splitter=splitter)
     
     embedder = OpenAIEmbeddings()
-    cache_dir = LocalFileStore(f"./.cache/embeddings/{file.name}")
-    cache_embedder = CacheBackedEmbeddings.from_bytes_store(embedder, cache_dir)
-    vectorstore = FAISS.from_documents(docs, cache_embedder)
-    retriever = vectorstore.as_retriever()
-    return retriever
+    cache_embedder = cache_embeddings(embedder)
+    index_key = f"openai-{file_hash}"
+    vectorstore = load_or_build_index(
+        index_key,
+        cache_embedder,
+        lambda base: build_index(
+            iter_split_files(file_paths, splitter_kwargs), cache_embedder, base=base
+        ),
+        name=f"openai-{'|'.join(sorted(file.name for file in files))}",
+    )
+    # 인덱스는 registry에 한번만 올리고 캐시에는 키만 든 retriever를 넣음
+    retriever = register(index_key, vectorstore)
+    return index_key, retriever
 
 def save_message(message, role):
     st.session_state.messages.append({"message": message, "role": role})
@@ -77,37 +89,6 @@ def paint_history():
         send_message(message["message"], message["role"], save=False)
 
 
-def format_docs(docs):
-    return "\n\n".join([doc.page_content for doc in docs])
-
-
-def load_memory(_):
-    return memory.load_memory_variables({})["chat_history"]
-
-
-memory = ConversationBufferMemory(
-    llm=llm,
-    return_messages=True,
-    max_token_limit=80,
-    memory_key="chat_history"
-)
-
-prompt = ChatPromptTemplate.from_messages(
-    [
-        (
-            "system",
-            """
-            Answer the question using ONLY the following context. If you don't know the answer just say you don't know. DON'T make anything up.
-            
-            Context: {context}
-            """,
-        ),
-        MessagesPlaceholder(variable_name="chat_history"),
-        ("human", "{question}"),
-    ]
-)
-
-
 st.title("DocumentGPT")
 st.markdown(
     """
@@ -116,33 +97,47 @@ st.markdown(
 )
 
 with st.sidebar:
-    file = st.file_uploader(
+    files = st.file_uploader(
         "Whatever",
-        type=["pdf", "txt", "docx"]
+        type=["pdf", "txt", "docx"],
+        accept_multiple_files=True,
     )
 
 # 파일첨부시 chat_input container가 뜨게, 처음 실행 시 파일이 없거나, 파일을 삭제하면 현재 세션을 빈 리스트로
-if file:
-    retriever = embed_file(file)
+if files:
+    index_key, retriever = embed_file(files)
     send_message("Lets Fucking Go", "ai", save=False)
     paint_history()
+    # 세션마다 따로. 요약용 llm은 스트리밍 안하는걸로 (파일 올렸을때 처음 만듦)
+    if "memory" not in st.session_state:
+        st.session_state.memory = SummaryWindowMemory(get_summary_llm())
+    memory = st.session_state.memory
     message = st.chat_input("LFG")
     if message:
         send_message(message, "user")
-        chain = (
-            {
-                "context": retriever | RunnableLambda(format_docs),
-                "question": RunnablePassthrough(),
-            }
-            | RunnablePassthrough.assign(chat_history=load_memory)
-            | prompt
-            | llm
-        )
+        # 같은 문서에 거의 같은 질문이면 캐시된 답변을 스트리밍처럼 다시 보여줌
+        # 질문 임베딩은 한번만 만들어서 캐시 찾기랑 문서 검색에 같이 씀
+        question_vector = get_query_embedder().embed_query(message)
+        chain_input = {
+            "question": message,
+            "retriever": retriever,
+            "memory": memory,
+            "question_vector": question_vector,
+        }
+        # 대화가 이어지는 중이면 "왜?" 같은 질문의 답이 이전 대화에 따라 달라짐 -> 대화 첫 질문만 캐시
+        cacheable = memory.is_empty()
+        answer = answer_cache.lookup(index_key, question_vector) if cacheable else None
         with st.chat_message("ai"):
-            response = chain.invoke(message)
-            memory.save_context(
-                {"input": message},
-                {"output": response.content},
-            )
+            if answer is None:
+                # 체인은 공유 이벤트 루프에서 astream, 토큰만 여기서 그림
+                answer = stream_tokens(
+                    chat_handler, (chunk.content for chunk in iterate(get_chain().astream(chain_input)))
+                )
+                if cacheable:
+                    answer_cache.store(index_key, message, question_vector, answer)
+            else:
+                replay(chat_handler, answer)
+            memory.save_context(message, answer)
 else:
     st.session_state.messages = []
+    st.session_state.pop("memory", None)
@@ -1,16 +1,31 @@
-import streamlit as st
+import os
+import re
 import asyncio
-import nest_asyncio
-from langchain.chat_models import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from langchain.document_loaders import AsyncChromiumLoader, SitemapLoader
-from langchain.document_transformers import Html2TextTransformer
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.vectorstores import FAISS
-from langchain.embeddings import OpenAIEmbeddings, CacheBackedEmbeddings
-from langchain.storage import LocalFileStore
-from urllib.parse import urlparse
+import functools
+import streamlit as st
 from langchain.schema.runnable import RunnablePassthrough, RunnableLambda
+from utils.chat import ChatCallbackHandler, stream_tokens
+from utils.context import pack_docs
+from utils.crawler import crawl_site, get_page_cache
+from utils.index import hash_bytes, load_or_build_index
+from utils.ingest import build_index
+from utils.registry import register
+from utils.runner import iterate
+from utils.stores import cache_embeddings
+
+
+# 문서별 답변(map)은 동시에 이만큼씩, 하나당 이 시간 넘으면 버림
+ANSWER_CONCURRENCY = int(os.environ.get("SITE_ANSWER_CONCURRENCY", 4))
+ANSWER_TIMEOUT = float(os.environ.get("SITE_ANSWER_TIMEOUT", 30))
+# 점수 HIGH_SCORE 이상인 답이 ENOUGH_ANSWERS개 모이면 나머지는 안기다림
+HIGH_SCORE = 4
+ENOUGH_ANSWERS = 2
+# retriever 관련도(0~1)가 이것보다 낮은 문서는 map 단계에 안보냄
+SCORE_THRESHOLD = float(os.environ.get("SITE_SCORE_THRESHOLD", 0.65))
+# 사이트 다시 긁는 주기(초). 페이지 캐시가 있어서 바뀐 페이지만 받음
+SITE_REFRESH_SECONDS = int(os.environ.get("SITE_REFRESH_SECONDS", 60 * 60 * 24))
+# splitter 설정 바꾸면 같이 올려야 캐시된 청크를 안씀
+SPLITTER_VERSION = "tiktoken-1000-200"
 
 
 
@@ -49,93 +64,152 @@ with st.sidebar:
 #     st.write(documents)
 #     transformed = html2TextTransformer.transform_documents(documents)
 #     st.write(documents)
-llm = ChatOpenAI(
-    temperature=0.1,
-    model="gpt-3.5-turbo-1106",
-    streaming=True,
-)
 
 
-answer_prompt = ChatPromptTemplate.from_template(
-    """
-    Using ONLY the following context answer the user's question. If you can't just say you don't know, don't make anything up.
+# llm, 프롬프트, 체인은 프로세스에 하나씩만 만들어서 세션끼리 공유 (rerun마다 새로 안만듦)
+@st.cache_resource
+def get_chains():
+    from langchain.chat_models import ChatOpenAI
+    from langchain.prompts import ChatPromptTemplate
+
+    llm = ChatOpenAI(
+        temperature=0.1,
+        model="gpt-3.5-turbo-1106",
+        streaming=True,
+    )
 
-    Then, give a score to the answer between 0 and 5.
+    answer_prompt = ChatPromptTemplate.from_template(
+        """
+        Using ONLY the following context answer the user's question. If you can't just say you don't know, don't make anything up.
 
-    If the answer answers the user question the score should be high, else it should be low.
+        Then, give a score to the answer between 0 and 5.
 
-    Make sure to always include the answer's score even if it's 0.
+        If the answer answers the user question the score should be high, else it should be low.
 
-    Context: {context}
+        Make sure to always include the answer's score even if it's 0.
+
+        Context: {context}
         
-    Examples:
+        Examples:
 
-    Question: How far away is the moon?
-    Answer: The moon is 384,400 km away.
-    Score: 5
+        Question: How far away is the moon?
+        Answer: The moon is 384,400 km away.
+        Score: 5
 
-    Question: How far away is the sun?
-    Answer: I don't know
-    Score: 0
+        Question: How far away is the sun?
+        Answer: I don't know
+        Score: 0
 
-    Your turn!
+        Your turn!
 
-    Question: {question}
-    """
-)
+        Question: {question}
+        """
+    )
 
-def get_answer(input):
-    docs = input["docs"]
-    question = input["question"]
-    answer_chain = answer_prompt | llm
-    return {
-        "question": question,
-        "answers": [
-            {
-                "answer": answer_chain.invoke(
-                    {"question": question, "context": doc.page_content}
-                ).content,
-                "source": doc.metadata["source"],
-            }
-            for doc in docs
-        ],
-    }
+    choose_prompt = ChatPromptTemplate.from_messages(
+        [
+            (
+                "system",
+                """
+                Use ONLY the following pre-existing answers to answer the user's question.
 
+                Use the answers that have the highest score (more helpful).
 
+                Cite sources and return the sources of the answers as they are, do not change them.
 
-choose_prompt = ChatPromptTemplate.from_messages(
-    [
-        (
-            "system",
-            """
-            Use ONLY the following pre-existing answers to answer the user's question.
 
-            Use the answers that have the highest score (more helpful).
+                Answers: {answers}
+                """,
+            ),
+            ("human", "{question}"),
+        ]
+    )
 
-            Cite sources and return the sources of the answers as they are, do not change them.
+    return answer_prompt | llm, choose_prompt | llm
 
 
-            Answers: {answers}
-            """,
-        ),
-        ("human", "{question}"),
-    ]
-)
+chat_handler = ChatCallbackHandler()
 
-def choose_answer(inputs):
-    docs = inputs["answers"]
-    question = inputs["question"]
+
+def answer_score(answer):
+    match = re.search(r"Score:\s*(\d)", answer["answer"])
+    return int(match.group(1)) if match else 0
+
+
+async def get_answer(input, answer_chain):
+    # 겹치는 청크는 합쳐서 LLM 호출 수 줄임. 문서마다 따로 부르니까 토큰 예산은 안씀
+    docs = pack_docs(input["docs"], max_tokens=None)
+    question = input["question"]
+    semaphore = asyncio.Semaphore(ANSWER_CONCURRENCY)
+
+    async def answer(doc):
+        async with semaphore:
+            response = await asyncio.wait_for(
+                answer_chain.ainvoke({"question": question, "context": doc.page_content}),
+                ANSWER_TIMEOUT,
+            )
+        return {"answer": response.content, "source": doc.metadata["source"]}
+
+    # 문서마다 동시에 물어보고 점수 높은 답이 충분히 모이면 나머지는 취소
+    tasks = [asyncio.create_task(answer(doc)) for doc in docs]
+    answers = []
+    error = None
+    try:
+        for next_answer in asyncio.as_completed(tasks):
+            try:
+                answers.append(await next_answer)
+            except Exception as e:
+                # 시간초과나 실패한 문서는 빼고 나머지로 답함
+                error = e
+                continue
+            if sum(answer_score(a) >= HIGH_SCORE for a in answers) >= ENOUGH_ANSWERS:
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+    if not answers and error is not None:
+        raise error
+    return {
+        "question": question,
+        "answers": sorted(answers, key=answer_score, reverse=True),
+    }
+
+
+# 점수 높은 답부터 합쳐서 choose 프롬프트 입력으로
+def condense_answers(inputs):
     condensed = "\n\n".join(
-        f"Answer: {doc['answer']}\nSource: {doc['source']}\n" for doc in docs
+        f"Answer: {doc['answer']}\nSource: {doc['source']}\n" for doc in inputs["answers"]
     )
-    choose_chain = choose_prompt | llm
-    return choose_chain.invoke(
-        {
-            "question": question,
-            "answers": condensed,
-        }
+    return {
+        "question": inputs["question"],
+        "answers": condensed,
+    }
+
+
+# 관련도 낮은 문서는 LLM한테 점수 매기라고 보내지도 않음
+# 다 낮으면 제일 높은거 하나만 (LLM 호출 1번으로 모른다고 답하게)
+async def retrieve(inputs):
+    retriever = inputs["retriever"]
+    vectorstore = await retriever.avectorstore()
+    results = await vectorstore.asimilarity_search_with_relevance_scores(
+        inputs["question"], **{"k": 4, **retriever.search_kwargs}
+    )
+    docs = [doc for doc, score in results if score >= SCORE_THRESHOLD]
+    return docs or [doc for doc, _ in results[:1]]
+
+
+# retriever는 세션마다 달라서 입력으로 받음 {"question", "retriever"}
+# 마지막이 choose_chain(llm)이라 astream하면 최종 답이 토큰 단위로 나옴
+# llm은 질문이 처음 들어올때 만듦 (페이지 처음 그릴때 langchain.chat_models import 안하게)
+@st.cache_resource
+def get_site_chain():
+    answer_chain, choose_chain = get_chains()
+    return (
+        RunnablePassthrough.assign(docs=RunnableLambda(retrieve))
+        | RunnableLambda(functools.partial(get_answer, answer_chain=answer_chain))
+        | RunnableLambda(condense_answers)
+        | choose_chain
     )
-        
 
 
 def parse_page(soup):
@@ -150,30 +224,56 @@ def parse_page(soup):
     )
 
 
-@st.cache_data(show_spinner="Scrapping...")
+# SITE_REFRESH_SECONDS 지나면 다시 긁음. 안바뀐 페이지는 페이지 캐시 덕에 요청/파싱/embed 안함
+@st.cache_data(show_spinner="Scrapping...", ttl=SITE_REFRESH_SECONDS)
 def load_url(url):
+    from bs4 import BeautifulSoup
+    from langchain.schema import Document
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from langchain.embeddings import OpenAIEmbeddings
+
     splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
     chunk_size=1000,
     chunk_overlap=200,
     )
 
-    loader = SitemapLoader(
+    # SitemapLoader(1초에 1개) 대신 비동기 크롤러. 호스트별 동시요청/간격 제한은 CRAWL_* 환경변수
+    # 공유 이벤트 루프에서 긁고, 도착하는 페이지부터 여기서 파싱/split
+    # sitemap lastmod가 같으면 요청 안하고, 아니면 ETag/Last-Modified로 조건부 GET
+    page_cache = get_page_cache()
+    documents = []
+    pages = crawl_site(
         url,
         # filter_urls=["https://platform.openai.com/docs/pricing"],
         # 대괄호안 url만 통과시키겠다.
         # filter_urls=[r"^(.*\/ranking\/).*"] # /rangking/을 포함하는 url만 통과시키겠다. 반대는 r"^(?!.*\/ranking\/).*"
-        parsing_function=parse_page,
+        cache=page_cache,
     )
-    loader.requests_per_second = 1 # 1초에 request 1번
-    documents = loader.load_and_split(text_splitter=splitter)
+    for page in iterate(pages):
+        chunks = None if page["changed"] else page_cache.get_chunks(page["loc"], SPLITTER_VERSION)
+        if chunks is None:
+            # 안바뀐 페이지는 html을 안들고 옴 (splitter 버전이 바뀐 경우 등에만 캐시에서 꺼냄)
+            html = page["html"] or page_cache.get_html(page["loc"])
+            text = parse_page(BeautifulSoup(html, "html.parser"))
+            chunks = splitter.split_text(text)
+            page_cache.set_chunks(page["loc"], SPLITTER_VERSION, chunks)
+        metadata = {"source": page["loc"], "loc": page["loc"], "lastmod": page["lastmod"]}
+        documents.extend(Document(page_content=chunk, metadata=dict(metadata)) for chunk in chunks)
+    # 도착 순서가 매번 달라서 정렬해야 같은 사이트면 같은 인덱스 키
+    documents.sort(key=lambda doc: doc.metadata["source"])
     embeddings = OpenAIEmbeddings()
-    # # URL을 파일 경로로 사용하기 위해 안전한 이름으로 변경
-    # parsed_url = urlparse(url)
-    # host = parsed_url.netloc.replace("www.", "").replace(".", "_")
-    # cache_dir = LocalFileStore(f"./.cache/site_embeddings/{host}")
-    # cache_embedder = CacheBackedEmbeddings.from_bytes_store(embeddings, cache_dir)
-    vectorstore = FAISS.from_documents(documents, embeddings)
-    return vectorstore.as_retriever()
+    cache_embedder = cache_embeddings(embeddings)
+    # 내용 해시로 키를 만듦 -> 사이트가 바뀌면 다른 인덱스, 그대로면 디스크에 있는걸 씀
+    # 바뀌었으면 같은 url의 예전 인덱스에서 바뀐 청크만 embed해서 넣고 없어진건 지움
+    content = "\0".join(f"{doc.metadata['source']}\n{doc.page_content}" for doc in documents)
+    index_key = f"site-{hash_bytes(content.encode())}"
+    vectorstore = load_or_build_index(
+        index_key,
+        cache_embedder,
+        lambda base: build_index(documents, cache_embedder, base=base),
+        name=f"site-{url}",
+    )
+    return register(index_key, vectorstore)
 
 if url:
     if ".xml" not in url:
@@ -183,10 +283,11 @@ if url:
         retriever = load_url(url)
         query = st.text_input("Ask bout this site")
         if query:
-            chain = {
-                "docs": retriever,
-                "question": RunnablePassthrough(),
-            } | RunnableLambda(get_answer) | RunnableLambda(choose_answer)
-
-            result = chain.invoke(query)
-            st.write(result.content.replace("$", "\$"))
\ No newline at end of file
+            # 체인은 공유 이벤트 루프에서 astream, 최종 답 토큰만 여기서 그림
+            stream_tokens(
+                chat_handler,
+                (
+                    chunk.content.replace("$", "\\$")
+                    for chunk in iterate(get_site_chain().astream({"question": query, "retriever": retriever}))
+                ),
+            )
\ No newline at end of file
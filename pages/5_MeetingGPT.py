@@ -1,19 +1,45 @@
 import streamlit as st
 import subprocess
 import math
-from pydub import AudioSegment
 import glob
 import openai
 import os
-from langchain.chat_models import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from langchain.document_loaders import TextLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.schema.output_parser import StrOutputParser
-
-llm = ChatOpenAI(
-    temperature=0.1
-)
+
+# llm, 프롬프트, 체인은 프로세스에 하나씩만 만들어서 세션끼리 공유 (rerun마다 새로 안만듦)
+@st.cache_resource
+def get_summary_chains():
+    from langchain.chat_models import ChatOpenAI
+    from langchain.prompts import ChatPromptTemplate
+    from langchain.schema.output_parser import StrOutputParser
+
+    llm = ChatOpenAI(
+        temperature=0.1
+    )
+
+    first_summary_prompt = ChatPromptTemplate.from_template(
+        """
+        Write a concise summary of the following:
+        "{text}"
+        CONCISE SUMMARY:                
+    """
+    )
+    first_summary_chain = first_summary_prompt | llm | StrOutputParser()
+
+    refine_prompt = ChatPromptTemplate.from_template(
+        """
+        Your job is to produce a final, consolidated summary.
+        An existing summary is provided: {existing_summary}
+        Refine the existing summary by incorporating the following new context.
+        ------------
+        {context}
+        ------------
+        Given the new context, refine the original summary. If the context isn't useful, return the original summary.
+        Output ONLY the refined summary, without any other text.
+        """
+    )
+    refine_chain = refine_prompt | llm | StrOutputParser()
+    return first_summary_chain, refine_chain
+
 
 @st.cache_data()
 def transcribe_chunks(chunk_folder, destination):
@@ -44,6 +70,8 @@ def extract_audio_from_video(video_path):
 
 @st.cache_data()
 def cut_audio_in_chunks(audio_path, chunk_size, chunks_folder):
+    from pydub import AudioSegment
+
     track = AudioSegment.from_mp3(audio_path)
     chunk_len = chunk_size * 60 * 1000
     chunks = math.ceil(len(track) / chunk_len)
@@ -105,6 +133,9 @@ if video:
     with summary_tab:
         LFG = st.button("LFG")
         if LFG:
+            from langchain.document_loaders import TextLoader
+            from langchain.text_splitter import RecursiveCharacterTextSplitter
+
             loader = TextLoader(transcript_path, encoding="utf-8")
             splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
                 chunk_size=1000,
@@ -113,33 +144,12 @@ if video:
             docs = loader.load_and_split(text_splitter=splitter)
 
 
-            first_summary_prompt = ChatPromptTemplate.from_template(
-                """
-                Write a concise summary of the following:
-                "{text}"
-                CONCISE SUMMARY:                
-            """
-            )
-            first_summary_chain = first_summary_prompt | llm | StrOutputParser()
+            first_summary_chain, refine_chain = get_summary_chains()
             summary = first_summary_chain.invoke(
                 {"text": docs[0].page_content},
             )
 
 
-            refine_prompt = ChatPromptTemplate.from_template(
-                """
-                Your job is to produce a final, consolidated summary.
-                An existing summary is provided: {existing_summary}
-                Refine the existing summary by incorporating the following new context.
-                ------------
-                {context}
-                ------------
-                Given the new context, refine the original summary. If the context isn't useful, return the original summary.
-                Output ONLY the refined summary, without any other text.
-                """
-            )
-            refine_chain = refine_prompt | llm | StrOutputParser()
-
             with st.status("Summarizing...") as status:
                 for i, doc in enumerate(docs[1:]):
                     status.update(label=f"Summarizing chunk {i+1}/{len(docs)-1}...")    
@@ -1,20 +1,12 @@
 import streamlit as st
 import os, requests
 from typing import Any, Type
-from langchain.chat_models import ChatOpenAI
-from langchain.tools import BaseTool, DuckDuckGoSearchResults
+from langchain.tools import BaseTool
 from pydantic import BaseModel, Field
-from langchain.agents import initialize_agent, AgentType
 from langchain.callbacks import get_openai_callback
-from langchain.schema import SystemMessage
+from utils.runner import run
 
 
-llm = ChatOpenAI(
-    model="gpt-4o-mini",
-    temperature=0.1, 
-    max_tokens=16384,
-)
-
 alpha_vantage_api_key = os.environ.get("ALPHA_VANTAGE_API_KEY")
 
 
@@ -31,6 +23,8 @@ class StockMarketSymbolSearchTool(BaseTool):
     args_schema: Type[StockMarketSymbolSearchToolArgsSchema] = StockMarketSymbolSearchToolArgsSchema
 
     def _run(self, query):
+        from langchain.tools import DuckDuckGoSearchResults
+
         ddg = DuckDuckGoSearchResults()
         return ddg.run(query)
 
@@ -83,31 +77,44 @@ class CompanyStockPerformanceTool(BaseTool):
         return list(response["Weekly Time Series"].items())[:200]
 
 
-agent = initialize_agent(
-    llm=llm,
-    verbose=True,
-    agent=AgentType.OPENAI_FUNCTIONS,
-    handle_parsing_errors=True,
-    tools=[
-        CompanyIncomeStatementTool(),
-        CompanyStockPerformanceTool(),
-        StockMarketSymbolSearchTool(),
-        CompanyOverviewTool(),
-    ],
-    agent_kwargs={
-        "system_message": SystemMessage(
-            content="""
-            You are a hedge fund manager.
+# llm, agent는 프로세스에 하나씩만 만들어서 세션끼리 공유 (rerun마다 새로 안만듦)
+@st.cache_resource
+def get_agent():
+    from langchain.chat_models import ChatOpenAI
+    from langchain.agents import initialize_agent, AgentType
+    from langchain.schema import SystemMessage
+
+    llm = ChatOpenAI(
+        model="gpt-4o-mini",
+        temperature=0.1, 
+        max_tokens=16384,
+    )
+    return initialize_agent(
+        llm=llm,
+        verbose=True,
+        agent=AgentType.OPENAI_FUNCTIONS,
+        handle_parsing_errors=True,
+        tools=[
+            CompanyIncomeStatementTool(),
+            CompanyStockPerformanceTool(),
+            StockMarketSymbolSearchTool(),
+            CompanyOverviewTool(),
+        ],
+        agent_kwargs={
+            "system_message": SystemMessage(
+                content="""
+                You are a hedge fund manager.
             
-            You evaluate a company and provide your opinion and reasons why the stock is a buy or not.
+                You evaluate a company and provide your opinion and reasons why the stock is a buy or not.
             
-            Consider the performance of a stock, the company overview and the income statement.
+                Consider the performance of a stock, the company overview and the income statement.
             
-            Be assertive in your judgement and recommend the stock or advise the user against it.
-        """
-        )
-    },
-)
+                Be assertive in your judgement and recommend the stock or advise the user against it.
+            """
+            )
+        },
+    )
+
 
 st.set_page_config(
     page_title="InvestorGPT",
@@ -128,7 +135,8 @@ company = st.text_input("Write the name of the company you are interested on.")
 
 if company:
     with get_openai_callback() as usage:
-        result = agent.invoke(company)
+        # 공유 이벤트 루프에서 ainvoke. 콜백(usage)은 contextvars로 그대로 넘어감
+        result = run(get_agent().ainvoke(company))
 
     st.write(result["output"].replace("$", "\$"))
     print(usage)
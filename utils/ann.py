@@ -0,0 +1,174 @@
+import os
+import math
+import time
+import logging
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+# index 전체(벡터+그래프/코드북)가 이 안에 들어가게 고름
+INDEX_MEMORY_BUDGET = int(os.environ.get("INDEX_MEMORY_BUDGET_MB", 2048)) * 1024 * 1024
+# 이보다 작으면 그냥 flat(정확검색)이 제일 빠르고 정확함
+FLAT_MAX_VECTORS = 20_000
+HNSW_MAX_VECTORS = 1_000_000
+HNSW_M = 32
+TRAIN_MAX_VECTORS = 100_000
+# flat에서 벡터를 이만큼씩 꺼내서 옮김 -> 전체 복사본을 안만듦
+ADD_BATCH_SIZE = 65_536
+# 임베딩 캐시에서 꺼낸 벡터는 파이썬 float 리스트(1536차원에 ~49KB)라 조금씩 꺼내서 float32로 바꿈
+REBUILD_BATCH_SIZE = 4_096
+REPORT_QUERIES = 200
+REPORT_K = 4
+
+
+# 벡터 개수, 차원, 메모리 예산 보고 faiss index_factory 문자열 고름
+def choose_factory(n, dim, memory_budget=INDEX_MEMORY_BUDGET):
+    flat_bytes = n * dim * 4
+    if n <= FLAT_MAX_VECTORS and flat_bytes <= memory_budget:
+        return "Flat"
+    # HNSW는 level0에서 벡터당 링크 2*M개(int32)를 더 먹음
+    if n <= HNSW_MAX_VECTORS and flat_bytes + n * HNSW_M * 2 * 4 <= memory_budget:
+        return f"HNSW{HNSW_M}"
+    nlist = min(65536, max(64, int(4 * math.sqrt(n))))
+    if flat_bytes <= memory_budget:
+        return f"IVF{nlist},Flat"
+    if n * dim * 2 <= memory_budget:
+        return f"IVF{nlist},SQfp16"
+    if n * dim <= memory_budget:
+        return f"IVF{nlist},SQ8"
+    # PQ: 벡터당 m바이트. 차원을 나눠떨어지게 하는 m 중 예산 안에 들어가는 제일 큰 값
+    for m in (96, 64, 48, 32, 24, 16, 8):
+        if dim % m == 0 and n * m <= memory_budget:
+            return f"IVF{nlist},PQ{m}"
+    return f"IVF{nlist},PQ8"
+
+
+def tune(index, factory):
+    import faiss
+
+    if factory.startswith("IVF"):
+        faiss.extract_index_ivf(index).nprobe = 16
+    elif factory.startswith("HNSW"):
+        index.hnsw.efSearch = 64
+
+
+def is_flat(index):
+    import faiss
+
+    return isinstance(index, faiss.IndexFlat)
+
+
+# index가 메모리에서 차지하는 바이트 추정 (serialize 안하고 구조만 보고 계산)
+def index_bytes(index):
+    import faiss
+
+    if isinstance(index, faiss.IndexHNSW):
+        # level0 링크(int32)만 셈, 윗 레벨은 얼마 안됨
+        return index_bytes(index.storage) + index.ntotal * index.hnsw.nb_neighbors(0) * 4
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        # 코드 + id(int64) + coarse quantizer
+        return index.ntotal * (ivf.code_size + 8) + index_bytes(ivf.quantizer)
+    return index.ntotal * index.sa_code_size()
+
+
+# 예전 flat index랑 새 index를 같은 쿼리로 돌려서 recall@k / 평균 latency 비교
+def index_report(flat_index, index, factory):
+    n = flat_index.ntotal
+    rng = np.random.default_rng(0)
+    query_ids = rng.choice(n, size=min(REPORT_QUERIES, n), replace=False)
+    queries = np.vstack([flat_index.reconstruct(int(i)) for i in query_ids])
+
+    start = time.perf_counter()
+    _, truth = flat_index.search(queries, REPORT_K)
+    flat_latency = (time.perf_counter() - start) / len(queries)
+    start = time.perf_counter()
+    _, found = index.search(queries, REPORT_K)
+    latency = (time.perf_counter() - start) / len(queries)
+
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+    return {
+        "factory": factory,
+        "vectors": n,
+        "dim": flat_index.d,
+        f"recall@{REPORT_K}": hits / (len(queries) * REPORT_K),
+        "latency_ms": latency * 1000,
+        "flat_latency_ms": flat_latency * 1000,
+    }
+
+
+def iter_vectors(flat_index, batch_size=ADD_BATCH_SIZE):
+    for start in range(0, flat_index.ntotal, batch_size):
+        yield start, flat_index.reconstruct_n(start, min(batch_size, flat_index.ntotal - start))
+
+
+# 학습용 샘플만 batch 돌면서 골라냄
+def sample_vectors(flat_index, size=TRAIN_MAX_VECTORS):
+    n = flat_index.ntotal
+    rng = np.random.default_rng(0)
+    ids = np.sort(rng.choice(n, size=min(size, n), replace=False))
+    parts = []
+    for start, vectors in iter_vectors(flat_index):
+        batch_ids = ids[(ids >= start) & (ids < start + len(vectors))]
+        if len(batch_ids):
+            parts.append(vectors[batch_ids - start])
+    return np.vstack(parts)
+
+
+# build는 항상 flat으로 하고 마지막에 크기 보고 ANN index로 바꿈
+# flat을 통째로 복사하면 잠깐 메모리가 flat 2배가 됨 -> 샘플로 학습하고 batch로 나눠서 add
+def compact_index(vectorstore, memory_budget=INDEX_MEMORY_BUDGET):
+    import faiss
+    from langchain.vectorstores import FAISS
+
+    flat_index = vectorstore.index
+    if not is_flat(flat_index):
+        return vectorstore
+    n, dim = flat_index.ntotal, flat_index.d
+    if n * dim * 4 > memory_budget:
+        # build_index는 항상 flat으로 다 만든 다음에 바꿈 -> 만드는 동안은 flat 크기만큼 필요
+        logger.warning(
+            "flat build index (%d MB) is larger than INDEX_MEMORY_BUDGET_MB (%d MB)",
+            n * dim * 4 // 2**20,
+            memory_budget // 2**20,
+        )
+    factory = choose_factory(n, dim, memory_budget)
+    if factory == "Flat":
+        return vectorstore
+
+    index = faiss.index_factory(dim, factory, flat_index.metric_type)
+    if not index.is_trained:
+        index.train(sample_vectors(flat_index))
+    for _, vectors in iter_vectors(flat_index):
+        index.add(vectors)
+    tune(index, factory)
+
+    report = index_report(flat_index, index, factory)
+    logger.info("ANN index report: %s", report)
+    compacted = FAISS(
+        vectorstore.embedding_function,
+        index,
+        vectorstore.docstore,
+        vectorstore.index_to_docstore_id,
+    )
+    compacted.report = report
+    return compacted
+
+
+# HNSW나 IVF는 삭제가 안되거나 느림 -> 증분 업데이트 전에 flat으로 되돌림
+# 벡터는 임베딩 캐시에서 batch씩 다시 꺼내오니까 API 호출도 없고 전체를 리스트로 들고있지도 않음
+# (PQ처럼 손실 압축이라 reconstruct로는 원래 벡터가 안나옴)
+def to_flat(vectorstore, embeddings, batch_size=REBUILD_BATCH_SIZE):
+    import faiss
+    from langchain.vectorstores import FAISS
+
+    index = vectorstore.index
+    if is_flat(index):
+        return vectorstore
+    flat_index = faiss.IndexFlat(index.d, index.metric_type)
+    for start in range(0, index.ntotal, batch_size):
+        ids = [vectorstore.index_to_docstore_id[i] for i in range(start, min(start + batch_size, index.ntotal))]
+        texts = [vectorstore.docstore.search(id).page_content for id in ids]
+        flat_index.add(np.asarray(embeddings.embed_documents(texts), dtype=np.float32))
+    return FAISS(embeddings, flat_index, vectorstore.docstore, vectorstore.index_to_docstore_id)
@@ -0,0 +1,51 @@
+from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain.schema.runnable import RunnableLambda, RunnablePassthrough
+from utils.context import format_docs
+
+
+rag_prompt = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            """
+            Answer the question using ONLY the following context. If you don't know the answer just say you don't know. DON'T make anything up.
+            
+            Context: {context}
+            """,
+        ),
+        MessagesPlaceholder(variable_name="chat_history"),
+        ("human", "{question}"),
+    ]
+)
+
+
+# 답변 캐시 찾을때 만든 질문 임베딩(question_vector)이 있으면 그걸로 검색 -> 질문을 두번 embed 안함
+def retrieve_context(inputs):
+    vector = inputs.get("question_vector")
+    if vector is not None:
+        return format_docs(inputs["retriever"].search_by_vector(vector))
+    return format_docs(inputs["retriever"].get_relevant_documents(inputs["question"]))
+
+
+async def aretrieve_context(inputs):
+    vector = inputs.get("question_vector")
+    if vector is not None:
+        return format_docs(await inputs["retriever"].asearch_by_vector(vector))
+    return format_docs(await inputs["retriever"].aget_relevant_documents(inputs["question"]))
+
+
+def load_history(inputs):
+    return inputs["memory"].load_messages()
+
+
+# 체인은 프로세스에 하나만 만들고 세션끼리 공유
+# 세션마다 다른 retriever, memory는 입력으로 받음 {"question", "retriever", "memory", "question_vector"(없어도 됨)}
+def build_rag_chain(llm):
+    return (
+        RunnablePassthrough.assign(
+            context=RunnableLambda(retrieve_context, afunc=aretrieve_context),
+            chat_history=RunnableLambda(load_history),
+        )
+        | rag_prompt
+        | llm
+    )
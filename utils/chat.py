@@ -0,0 +1,128 @@
+import os
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+import streamlit as st
+from langchain.callbacks.base import BaseCallbackHandler
+
+
+logger = logging.getLogger(__name__)
+
+
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", 0.95))
+ANSWER_CACHE_TTL = int(os.environ.get("ANSWER_CACHE_TTL", 60 * 60 * 24))
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", 1000))
+# 토큰마다 다시 그리지 않고 50ms 또는 토큰 20개마다 한번씩 그림
+STREAM_FLUSH_INTERVAL = float(os.environ.get("STREAM_FLUSH_INTERVAL", 0.05))
+STREAM_FLUSH_TOKENS = int(os.environ.get("STREAM_FLUSH_TOKENS", 20))
+
+
+class ChatCallbackHandler(BaseCallbackHandler):
+    def __init__(self, on_end=None, flush_interval=STREAM_FLUSH_INTERVAL, flush_tokens=STREAM_FLUSH_TOKENS):
+        self.on_end = on_end
+        self.flush_interval = flush_interval
+        self.flush_tokens = flush_tokens
+        self.message = ""
+        self.metrics = {}
+
+    def on_llm_start(self, *args, **kwargs):
+        self.message_box = st.empty()
+        self.message = ""
+        self.buffer = []
+        self.token_count = 0
+        self.started_at = self.flushed_at = time.perf_counter()
+        self.first_token_at = None
+
+    def on_llm_new_token(self, token, *args, **kwargs):
+        now = time.perf_counter()
+        if self.first_token_at is None:
+            self.first_token_at = now
+        self.buffer.append(token)
+        self.token_count += 1
+        if len(self.buffer) >= self.flush_tokens or now - self.flushed_at >= self.flush_interval:
+            self.flush(now)
+
+    def flush(self, now):
+        if self.buffer:
+            self.message += "".join(self.buffer)
+            self.buffer = []
+            self.message_box.markdown(self.message)
+        self.flushed_at = now
+
+    def on_llm_end(self, *args, **kwargs):
+        now = time.perf_counter()
+        self.flush(now)
+        first_token_at = self.first_token_at or now
+        generation_time = now - first_token_at
+        self.metrics = {
+            "time_to_first_token": first_token_at - self.started_at,
+            "tokens": self.token_count,
+            "tokens_per_second": self.token_count / generation_time if generation_time else 0.0,
+        }
+        logger.info("LLM stream metrics: %s", self.metrics)
+        if self.on_end:
+            self.on_end(self.message)
+
+
+# 같은 index(문서 버전)에 거의 같은 질문이 오면 LLM 안거치고 이전 답변 재사용
+# key = (index 버전, 질문), 비교는 질문 임베딩 코사인 유사도
+# 답은 대화 기록 없이 만든것만 넣어야 함 (이어지는 대화의 답은 세션마다 다름)
+class SemanticCache:
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL, max_size=ANSWER_CACHE_SIZE):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def lookup(self, version, vector):
+        vector = normalize(vector)
+        now = time.time()
+        best_key, best_score = None, self.threshold
+        with self.lock:
+            for key, (entry_vector, _, created) in list(self.entries.items()):
+                if now - created > self.ttl:
+                    del self.entries[key]
+                    continue
+                if key[0] != version:
+                    continue
+                score = float(entry_vector @ vector)
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                return None
+            self.entries.move_to_end(best_key)
+            return self.entries[best_key][1]
+
+    def store(self, version, question, vector, answer):
+        with self.lock:
+            self.entries[(version, question)] = (normalize(vector), answer, time.time())
+            self.entries.move_to_end((version, question))
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+def normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+
+# 프로세스 전체에서 공유
+answer_cache = SemanticCache()
+
+
+# 스트리밍 토큰을 스크립트 스레드에서 handler로 직접 흘려보냄 (llm callback 대신)
+def stream_tokens(handler, tokens):
+    handler.on_llm_start({}, [])
+    for token in tokens:
+        handler.on_llm_new_token(token)
+    handler.on_llm_end(None)
+    return handler.message
+
+
+# 캐시된 답변도 스트리밍처럼 callback handler로 흘려보냄
+def replay(handler, text):
+    return stream_tokens(handler, re.findall(r"\s*\S+|\s+", text))
@@ -0,0 +1,65 @@
+import os
+import functools
+from langchain.schema import Document
+
+
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 3000))
+# 이것보다 짧게 겹치는건 우연으로 보고 안합침
+MIN_OVERLAP = 20
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding():
+    import tiktoken
+
+    return tiktoken.get_encoding("cl100k_base")
+
+
+# a 뒤에 b가 이어지는 경우 (splitter의 chunk_overlap) 겹치는 부분 한번만 남기고 합침
+def merge_overlap(a, b):
+    if b in a:
+        return a
+    head = b[:MIN_OVERLAP]
+    start = a.find(head, max(0, len(a) - len(b)))
+    while start != -1:
+        if b.startswith(a[start:]):
+            return a + b[len(a) - start :]
+        start = a.find(head, start + 1)
+    return None
+
+
+# retriever 결과(관련도 순)에서 겹치거나 중복되는 청크를 합치고 토큰 예산만큼만 채움
+# max_tokens=None이면 합치기만 함 (문서마다 LLM을 따로 부르는 map 단계용)
+def pack_docs(docs, max_tokens=CONTEXT_TOKEN_BUDGET):
+    pieces = []
+    for doc in docs:
+        text = doc.page_content.strip()
+        source = doc.metadata.get("source")
+        for piece in pieces:
+            if piece[0] != source:
+                continue
+            merged = merge_overlap(piece[1], text) or merge_overlap(text, piece[1])
+            if merged is not None:
+                piece[1] = merged
+                break
+        else:
+            pieces.append([source, text, doc.metadata])
+    if max_tokens is None:
+        return [Document(page_content=text, metadata=metadata) for _, text, metadata in pieces]
+
+    encoding = get_encoding()
+    packed = []
+    remaining = max_tokens
+    for _, text, metadata in pieces:
+        tokens = encoding.encode(text)
+        if len(tokens) > remaining:
+            if remaining >= MIN_OVERLAP:
+                packed.append(Document(page_content=encoding.decode(tokens[:remaining]), metadata=metadata))
+            break
+        packed.append(Document(page_content=text, metadata=metadata))
+        remaining -= len(tokens)
+    return packed
+
+
+def format_docs(docs):
+    return "\n\n".join(doc.page_content for doc in pack_docs(docs))
@@ -0,0 +1,346 @@
+import os
+import re
+import gzip
+import json
+import time
+import zlib
+import codecs
+import sqlite3
+import threading
+import random
+import asyncio
+import logging
+from urllib.parse import urljoin, urlparse
+from urllib.robotparser import RobotFileParser
+from xml.etree import ElementTree
+import aiohttp
+from utils.index import hash_bytes
+from utils.stores import CACHE_DIR, SQLITE_BATCH_SIZE
+
+
+logger = logging.getLogger(__name__)
+
+# SitemapLoader는 1초에 1개씩이라 페이지 5000개면 한시간 넘게 걸림
+# 전체 동시 요청 수 / 한 호스트에 동시 요청 수 / 한 호스트에 요청 사이 최소 간격(초)
+# 남의 문서 사이트를 긁으니까 기본은 호스트당 초당 4개까지. 더 세게 긁는건 환경변수로 직접 켜기
+CRAWL_CONCURRENCY = int(os.environ.get("CRAWL_CONCURRENCY", 32))
+CRAWL_PER_HOST = int(os.environ.get("CRAWL_PER_HOST", 2))
+CRAWL_DELAY = float(os.environ.get("CRAWL_DELAY", 0.25))
+# robots.txt의 Disallow, Crawl-delay, Request-rate를 따름 (CRAWL_ROBOTS=0이면 무시)
+CRAWL_ROBOTS = os.environ.get("CRAWL_ROBOTS", "1") != "0"
+CRAWL_RETRIES = int(os.environ.get("CRAWL_RETRIES", 3))
+CRAWL_BACKOFF = float(os.environ.get("CRAWL_BACKOFF", 0.5))
+CRAWL_TIMEOUT = float(os.environ.get("CRAWL_TIMEOUT", 30))
+USER_AGENT = os.environ.get("CRAWL_USER_AGENT", "FullStackGPT-SiteGPT/1.0")
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+# urlset이든 sitemapindex든 <loc>, <lastmod>만 뽑음 (.xml.gz면 먼저 압축 풀기)
+def parse_sitemap(data):
+    if data[:2] == b"\x1f\x8b":
+        data = gzip.decompress(data)
+    root = ElementTree.fromstring(data)
+    entries = []
+    for item in root:
+        fields = {local_name(child.tag): (child.text or "").strip() for child in item}
+        if fields.get("loc"):
+            entries.append({"loc": fields["loc"], "lastmod": fields.get("lastmod") or None})
+    return local_name(root.tag), entries
+
+
+# 페이지 html + ETag/Last-Modified + sitemap lastmod를 디스크에 남겨둠
+# 다음 크롤링때 lastmod가 같으면 요청 자체를 안하고, 다르면 조건부 GET(304면 그대로 씀)
+# split한 청크도 같이 저장 -> 안바뀐 페이지는 다시 파싱/split 안함
+# 크롤링할때는 메타데이터랑 html 해시만 읽고, html은 다시 split해야 하는 페이지만 꺼냄
+class PageCache:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, "
+            "lastmod TEXT, html BLOB NOT NULL, chunks TEXT, chunks_version TEXT, fetched REAL NOT NULL, hash TEXT)"
+        )
+        # hash 컬럼 없이 만들어진 캐시 (해시가 없는 페이지는 한번 바뀐걸로 봄)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(pages)")}
+        if "hash" not in columns:
+            self.conn.execute("ALTER TABLE pages ADD COLUMN hash TEXT")
+        self.conn.commit()
+
+    def get_many(self, urls):
+        found = {}
+        with self.lock:
+            for i in range(0, len(urls), SQLITE_BATCH_SIZE):
+                batch = urls[i : i + SQLITE_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                for url, etag, last_modified, lastmod, digest in self.conn.execute(
+                    f"SELECT url, etag, last_modified, lastmod, hash FROM pages WHERE url IN ({placeholders})",
+                    batch,
+                ):
+                    found[url] = {
+                        "etag": etag,
+                        "last_modified": last_modified,
+                        "lastmod": lastmod,
+                        "hash": digest,
+                    }
+        return found
+
+    def get_html(self, url):
+        with self.lock:
+            row = self.conn.execute("SELECT html FROM pages WHERE url = ?", (url,)).fetchone()
+        return zlib.decompress(row[0]).decode("utf-8") if row else None
+
+    # html이 바뀌었을때만 html을 다시 쓰고 청크를 지움
+    def set(self, url, etag, last_modified, lastmod, html=None, digest=None, changed=True):
+        with self.lock, self.conn:
+            if changed:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO pages (url, etag, last_modified, lastmod, html, hash, fetched) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (url, etag, last_modified, lastmod, zlib.compress(html.encode("utf-8")), digest, time.time()),
+                )
+            else:
+                self.conn.execute(
+                    "UPDATE pages SET etag = ?, last_modified = ?, lastmod = ?, fetched = ? WHERE url = ?",
+                    (etag, last_modified, lastmod, time.time(), url),
+                )
+
+    def get_chunks(self, url, version):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT chunks FROM pages WHERE url = ? AND chunks_version = ?", (url, version)
+            ).fetchone()
+        return json.loads(row[0]) if row and row[0] is not None else None
+
+    def set_chunks(self, url, version, chunks):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE pages SET chunks = ?, chunks_version = ? WHERE url = ?",
+                (json.dumps(chunks), version, url),
+            )
+
+
+_page_caches = {}
+_page_caches_lock = threading.Lock()
+
+
+def get_page_cache(path=f"{CACHE_DIR}/pages.sqlite"):
+    with _page_caches_lock:
+        if path not in _page_caches:
+            _page_caches[path] = PageCache(path)
+        return _page_caches[path]
+
+
+class Host:
+    def __init__(self, concurrency, delay):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.lock = asyncio.Lock()
+        self.next_at = 0.0
+        self.delay = delay
+        self.robots = None
+        self.robots_lock = asyncio.Lock()
+        self.robots_loaded = False
+
+
+class Crawler:
+    def __init__(
+        self,
+        concurrency=CRAWL_CONCURRENCY,
+        per_host=CRAWL_PER_HOST,
+        delay=CRAWL_DELAY,
+        retries=CRAWL_RETRIES,
+        backoff=CRAWL_BACKOFF,
+        timeout=CRAWL_TIMEOUT,
+        robots=CRAWL_ROBOTS,
+        cache=None,
+    ):
+        self.cache = cache
+        self.robots = robots
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.delay = delay
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.hosts = {}
+
+    async def __aenter__(self):
+        # 커넥션은 세션 하나에서 재사용 (keep-alive)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={"User-Agent": USER_AGENT},
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    def host(self, url):
+        netloc = urlparse(url).netloc
+        if netloc not in self.hosts:
+            self.hosts[netloc] = Host(self.per_host, self.delay)
+        return self.hosts[netloc]
+
+    # 호스트마다 처음 한번 robots.txt를 읽음. Crawl-delay/Request-rate가 delay보다 길면 그걸 씀
+    # 없거나 못읽으면 다 허용
+    async def load_robots(self, url):
+        host = self.host(url)
+        if host.robots_loaded or not self.robots:
+            return host
+        async with host.robots_lock:
+            if host.robots_loaded:
+                return host
+            try:
+                status, _, data = await self.fetch(urljoin(url, "/robots.txt"), robots=False)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                status = None
+            if status == 200:
+                parser = RobotFileParser()
+                parser.parse(data.decode("utf-8", errors="replace").splitlines())
+                host.robots = parser
+                crawl_delay = parser.crawl_delay(USER_AGENT)
+                rate = parser.request_rate(USER_AGENT)
+                if crawl_delay:
+                    host.delay = max(host.delay, float(crawl_delay))
+                if rate and rate.requests:
+                    host.delay = max(host.delay, rate.seconds / rate.requests)
+            host.robots_loaded = True
+        return host
+
+    def allowed(self, url):
+        robots = self.host(url).robots
+        return robots is None or robots.can_fetch(USER_AGENT, url)
+
+    # 같은 호스트에는 host.delay초에 한번씩만 요청 시작
+    async def polite(self, host):
+        if host.delay <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        async with host.lock:
+            wait = host.next_at - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            host.next_at = loop.time() + host.delay
+
+    def backoff_delay(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        delay = self.backoff * 2**attempt
+        return delay + random.uniform(0, delay / 2)
+
+    # 429/5xx, 연결 에러, 타임아웃은 backoff 하면서 다시 시도
+    async def fetch(self, url, headers=None, robots=True):
+        host = await self.load_robots(url) if robots else self.host(url)
+        async with host.semaphore:
+            for attempt in range(self.retries + 1):
+                await self.polite(host)
+                try:
+                    async with self.session.get(url, headers=headers) as response:
+                        if response.status not in RETRY_STATUSES or attempt == self.retries:
+                            return response.status, response.headers, await response.read()
+                        delay = self.backoff_delay(attempt, response)
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    if attempt == self.retries:
+                        raise
+                    delay = self.backoff_delay(attempt)
+                await asyncio.sleep(delay)
+
+    # sitemap index면 하위 sitemap을 동시에 읽어서 페이지 목록을 합침
+    async def sitemap(self, url, seen=None):
+        seen = set() if seen is None else seen
+        if url in seen:
+            return []
+        seen.add(url)
+        status, _, data = await self.fetch(url)
+        if status != 200:
+            raise ValueError(f"sitemap {url} returned {status}")
+        kind, entries = parse_sitemap(data)
+        if kind != "sitemapindex":
+            return entries
+        children = await asyncio.gather(
+            *[self.sitemap(urljoin(url, entry["loc"]), seen) for entry in entries]
+        )
+        return [entry for child in children for entry in child]
+
+    # page: loc, lastmod, html, changed(지난번 크롤링 이후 내용이 바뀌었는지)
+    # 안바뀐 페이지는 html이 None -> 필요하면 cache.get_html로 꺼냄
+    # sqlite/zlib은 공유 이벤트 루프를 막지 않게 스레드에서
+    async def fetch_page(self, entry, cached=None):
+        if cached and entry["lastmod"] and cached["lastmod"] == entry["lastmod"]:
+            return {**entry, "html": None, "changed": False}
+        headers = {}
+        if cached and cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached and cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+        await self.load_robots(entry["loc"])
+        if not self.allowed(entry["loc"]):
+            logger.info("skipping %s (disallowed by robots.txt)", entry["loc"])
+            return None
+        try:
+            status, response_headers, data = await self.fetch(entry["loc"], headers)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning("failed to fetch %s: %r", entry["loc"], e)
+            # 못받으면 예전에 받아둔거라도 씀
+            return {**entry, "html": None, "changed": False} if cached else None
+        if status == 304 and cached:
+            html, digest, changed = None, cached["hash"], False
+        elif status == 200:
+            html = data.decode(response_charset(response_headers), errors="replace")
+            digest = hash_bytes(html.encode("utf-8"))
+            changed = cached is None or cached["hash"] != digest
+        else:
+            logger.warning("failed to fetch %s: HTTP %d", entry["loc"], status)
+            return None
+        if self.cache is not None:
+            await asyncio.to_thread(
+                self.cache.set,
+                entry["loc"],
+                response_headers.get("ETag") or (cached and cached["etag"]),
+                response_headers.get("Last-Modified") or (cached and cached["last_modified"]),
+                entry["lastmod"],
+                html,
+                digest,
+                changed,
+            )
+        return {**entry, "html": html if changed else None, "changed": changed}
+
+    # 페이지가 도착하는 순서대로 내보냄 -> 받는쪽은 파싱/split을 바로 시작
+    async def crawl(self, sitemap_url, filter_urls=None):
+        entries = await self.sitemap(sitemap_url)
+        if filter_urls:
+            entries = [e for e in entries if any(re.match(pattern, e["loc"]) for pattern in filter_urls)]
+        cached = {}
+        if self.cache is not None:
+            cached = await asyncio.to_thread(self.cache.get_many, [e["loc"] for e in entries])
+        tasks = [asyncio.create_task(self.fetch_page(entry, cached.get(entry["loc"]))) for entry in entries]
+        try:
+            for next_page in asyncio.as_completed(tasks):
+                page = await next_page
+                if page is not None:
+                    yield page
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def response_charset(headers):
+    match = re.search(r"charset=([\w-]+)", headers.get("Content-Type", ""))
+    try:
+        return codecs.lookup(match.group(1)).name if match else "utf-8"
+    except LookupError:
+        return "utf-8"
+
+
+async def crawl_site(sitemap_url, filter_urls=None, cache=None, **kwargs):
+    async with Crawler(cache=cache, **kwargs) as crawler:
+        async for page in crawler.crawl(sitemap_url, filter_urls):
+            yield page
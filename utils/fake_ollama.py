@@ -0,0 +1,110 @@
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# 오프라인 벤치마크용 가짜 ollama. 같은 텍스트 -> 같은 벡터
+# latency: 요청마다 드는 시간, per_item: 텍스트 하나당 드는 시간 (모델 연산 흉내)
+def fake_vector(text, dim):
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        server = self.server
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path == "/api/embed" and not server.legacy:
+            texts = payload["input"] if isinstance(payload["input"], list) else [payload["input"]]
+            time.sleep(server.latency + server.per_item * len(texts))
+            self.send_json(200, {
+                "model": payload.get("model"),
+                "embeddings": [fake_vector(text, server.dim).tolist() for text in texts],
+            })
+        elif self.path == "/api/embeddings":
+            time.sleep(server.latency + server.per_item)
+            # 예전 엔드포인트는 정규화 안된 벡터를 줌
+            vector = fake_vector(payload["prompt"], server.dim) * 10
+            self.send_json(200, {"embedding": vector.tolist()})
+        else:
+            self.send_json(404, {"error": "404 page not found"})
+
+
+def serve(host="127.0.0.1", port=11434, dim=4096, latency=0.02, per_item=0.005, legacy=False):
+    server = ThreadingHTTPServer((host, port), FakeOllamaHandler)
+    server.daemon_threads = True
+    server.dim = dim
+    server.latency = latency
+    server.per_item = per_item
+    server.legacy = legacy
+    threading.Thread(target=server.serve_forever, name="fake-ollama", daemon=True).start()
+    return server
+
+
+def benchmark(server, count):
+    from langchain.embeddings import OllamaEmbeddings
+    from utils.ollama import OllamaBatchEmbeddings
+
+    base_url = f"http://{server.server_address[0]}:{server.server_address[1]}"
+    texts = [f"chunk {i} " * 20 for i in range(count)]
+    for embedder in [
+        OllamaEmbeddings(model="mistral:latest", base_url=base_url),
+        OllamaBatchEmbeddings(model="mistral:latest", base_url=base_url),
+    ]:
+        start = time.perf_counter()
+        vectors = embedder.embed_documents(texts)
+        elapsed = time.perf_counter() - start
+        assert len(vectors) == count
+        print(f"{type(embedder).__name__}: {count} texts in {elapsed:.2f}s ({count / elapsed:.1f}/s)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="가짜 ollama embedding 서버 (python -m utils.fake_ollama)")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--dim", type=int, default=4096)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--per-item", type=float, default=0.005)
+    parser.add_argument("--legacy", action="store_true", help="/api/embed 없는 예전 ollama 흉내")
+    parser.add_argument("--bench", type=int, metavar="N", help="N개 텍스트로 순차 vs 배치 비교하고 종료")
+    args = parser.parse_args(argv)
+
+    server = serve(
+        port=0 if args.bench else args.port,
+        dim=args.dim,
+        latency=args.latency,
+        per_item=args.per_item,
+        legacy=args.legacy,
+    )
+    if args.bench:
+        benchmark(server, args.bench)
+        server.shutdown()
+        return 0
+    print(f"fake ollama on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
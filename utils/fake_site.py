@@ -0,0 +1,194 @@
+import sys
+import gzip
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# 오프라인 테스트용 가짜 문서 사이트
+# /sitemap.xml (sitemap index) -> /sitemap-1.xml.gz, /sitemap-2.xml -> /page/<n>
+# latency: 요청마다 지연, fail_every: n번째 요청마다 503 (retry 확인용)
+def page_html(number, version):
+    return (
+        "<html><head><meta charset='utf-8'></head><body>"
+        "<header>Fake Docs navigation</header>"
+        f"<h1>Page {number}</h1>"
+        f"<p>This is page {number} (version {version}) of the fake documentation site. "
+        f"It explains feature {number} and how feature {number} relates to feature {number + 1}.</p>"
+        "<footer>Copyright Fake Docs</footer>"
+        "</body></html>"
+    )
+
+
+def urlset(numbers, server):
+    items = "".join(
+        f"<url><loc>{server.base_url}/page/{n}</loc><lastmod>{server.lastmod(n)}</lastmod></url>"
+        for n in numbers
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{items}</urlset>'
+    ).encode()
+
+
+class FakeSiteHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body=b"", content_type="text/html; charset=utf-8", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            count = server.requests
+            server.paths.append(self.path)
+        time.sleep(server.latency)
+        if server.fail_every and count % server.fail_every == 0:
+            return self.send(503, headers={"Retry-After": "0"})
+        half = server.pages // 2
+        if self.path == "/robots.txt" and server.robots is not None:
+            return self.send(200, server.robots.encode(), "text/plain")
+        if self.path == "/sitemap.xml":
+            body = (
+                '<?xml version="1.0" encoding="UTF-8"?>'
+                '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+                f"<sitemap><loc>{server.base_url}/sitemap-1.xml.gz</loc></sitemap>"
+                "<sitemap><loc>/sitemap-2.xml</loc></sitemap>"
+                "</sitemapindex>"
+            ).encode()
+            return self.send(200, body, "application/xml")
+        if self.path == "/sitemap-1.xml.gz":
+            return self.send(200, gzip.compress(urlset(range(half), server)), "application/gzip")
+        if self.path == "/sitemap-2.xml":
+            return self.send(200, urlset(range(half, server.pages), server), "application/xml")
+        if self.path.startswith("/page/"):
+            number = int(self.path.rsplit("/", 1)[1])
+            if number >= server.pages:
+                return self.send(404)
+            version = server.versions.get(number, 0)
+            headers = {"ETag": f'"{number}-{version}"', "Last-Modified": server.last_modified(number)}
+            if (
+                self.headers.get("If-None-Match") == headers["ETag"]
+                or self.headers.get("If-Modified-Since") == headers["Last-Modified"]
+            ):
+                with server.lock:
+                    server.not_modified += 1
+                return self.send(304, headers=headers)
+            return self.send(200, page_html(number, version).encode(), headers=headers)
+        return self.send(404)
+
+
+class FakeSite(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, pages=100, latency=0.05, fail_every=0, robots=None):
+        super().__init__(address, FakeSiteHandler)
+        self.robots = robots
+        self.pages = pages
+        self.latency = latency
+        self.fail_every = fail_every
+        self.versions = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.paths = []
+        self.not_modified = 0
+        self.base_url = f"http://127.0.0.1:{self.server_address[1]}"
+
+    def lastmod(self, number):
+        return f"2024-01-{1 + self.versions.get(number, 0):02d}"
+
+    def last_modified(self, number):
+        return f"Mon, {1 + self.versions.get(number, 0):02d} Jan 2024 00:00:00 GMT"
+
+    # 페이지 내용을 바꿈 -> ETag, Last-Modified, sitemap lastmod도 같이 바뀜
+    def touch(self, number):
+        self.versions[number] = self.versions.get(number, 0) + 1
+
+    def reset_counts(self):
+        with self.lock:
+            self.requests = 0
+            self.not_modified = 0
+            self.paths = []
+
+
+def serve(port=0, **kwargs):
+    server = FakeSite(("127.0.0.1", port), **kwargs)
+    threading.Thread(target=server.serve_forever, name="fake-site", daemon=True).start()
+    return server
+
+
+def crawl(server, cache=None, **crawler):
+    from utils.crawler import crawl_site
+    from utils.runner import iterate
+
+    server.reset_counts()
+    start = time.perf_counter()
+    pages = list(iterate(crawl_site(f"{server.base_url}/sitemap.xml", cache=cache, **crawler)))
+    elapsed = time.perf_counter() - start
+    changed = sum(page["changed"] for page in pages)
+    print(
+        f"crawled {len(pages)}/{server.pages} pages ({changed} changed) in {elapsed:.2f}s, "
+        f"{server.requests} requests, {server.not_modified} not modified"
+    )
+
+
+# 처음 전체 크롤링 -> 몇 페이지만 바꾸고 캐시 써서 다시 크롤링
+def benchmark(server, changed=5, **crawler):
+    import tempfile
+    from utils.crawler import PageCache
+
+    crawl(server, **crawler)
+    with tempfile.TemporaryDirectory() as folder:
+        cache = PageCache(f"{folder}/pages.sqlite")
+        crawl(server, cache, **crawler)
+        for number in range(changed):
+            server.touch(number)
+        crawl(server, cache, **crawler)
+        cache.conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="가짜 문서 사이트 (python -m utils.fake_site)")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--fail-every", type=int, default=0)
+    parser.add_argument("--robots", help="robots.txt 내용 (예: 'User-agent: *\\nCrawl-delay: 1')")
+    parser.add_argument("--bench", action="store_true", help="크롤러로 한번 다 긁어보고 종료")
+    # 로컬 가짜 서버라 bench는 기본으로 세게 긁음 (실제 사이트 기본값은 utils/crawler.py CRAWL_*)
+    parser.add_argument("--per-host", type=int, default=8)
+    parser.add_argument("--delay", type=float, default=0)
+    args = parser.parse_args(argv)
+
+    server = serve(
+        port=0 if args.bench else args.port,
+        pages=args.pages,
+        latency=args.latency,
+        fail_every=args.fail_every,
+        robots=args.robots.replace("\\n", "\n") if args.robots else None,
+    )
+    if args.bench:
+        benchmark(server, per_host=args.per_host, delay=args.delay)
+        server.shutdown()
+        return 0
+    print(f"fake site on {server.base_url}/sitemap.xml")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
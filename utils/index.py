@@ -0,0 +1,105 @@
+import os
+import json
+import pickle
+import shutil
+import hashlib
+from pathlib import Path
+
+
+INDEX_DIR = "./.cache/indexes"
+# 문서 이름 -> 가장 최근 index key. 수정된 파일이 다시 올라오면 여기서 이전 버전을 찾음
+LATEST_DIR = f"{INDEX_DIR}/latest"
+
+
+def hash_bytes(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+# 파일 여러개를 하나의 index로 묶을때 key
+def combine_hashes(hashes):
+    if len(hashes) == 1:
+        return hashes[0]
+    return hash_bytes("".join(sorted(hashes)).encode())
+
+
+# 청크 id = 내용 해시 (한 문서 안에 같은 내용이 또 나오면 뒤에 번호 붙임)
+def chunk_ids(docs):
+    seen = {}
+    for doc in docs:
+        digest = hash_bytes(doc.page_content.encode())
+        count = seen.get(digest, 0)
+        seen[digest] = count + 1
+        yield (digest if count == 0 else f"{digest}-{count}"), doc
+
+
+def index_path(key):
+    return Path(INDEX_DIR) / key
+
+
+def has_index(key):
+    return (index_path(key) / "index.faiss").exists()
+
+
+def load_index(key, embeddings):
+    import faiss
+    from langchain.vectorstores import FAISS
+
+    path = index_path(key)
+    # 인덱스 전체를 메모리로 읽음 (IO_FLAG_MMAP은 IVF 리스트에만 먹혀서 flat/HNSW는 어차피 다 읽음)
+    # 메모리는 utils/registry.py 예산으로 관리
+    index = faiss.read_index(str(path / "index.faiss"))
+    with open(path / "index.pkl", "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+def save_index(key, vectorstore):
+    path = index_path(key)
+    tmp_path = path.with_name(f"{key}.tmp-{os.getpid()}")
+    vectorstore.save_local(str(tmp_path))
+    report = getattr(vectorstore, "report", None)
+    if report:
+        with open(tmp_path / "report.json", "w") as f:
+            json.dump(report, f, indent=2)
+    # 다른 워커가 먼저 저장했으면 그걸 쓰고 내꺼는 버림
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def latest_path(name):
+    return Path(LATEST_DIR) / hash_bytes(name.encode())
+
+
+def get_latest(name):
+    try:
+        return latest_path(name).read_text()
+    except FileNotFoundError:
+        return None
+
+
+def set_latest(name, key):
+    path = latest_path(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+    tmp_path.write_text(key)
+    os.replace(tmp_path, path)
+
+
+# key는 파일 내용 해시 -> 재시작해도, 이름이 같은 다른 파일이어도 안전
+# name이 같은 이전 버전 index가 있으면 그걸 base로 build에 넘겨서 바뀐 청크만 반영
+# base는 디스크에서 새로 연 복사본이라 다른 세션이 쓰고있는 retriever는 안건드림
+def load_or_build_index(key, embeddings, build, name=None):
+    if has_index(key):
+        vectorstore = load_index(key, embeddings)
+    else:
+        base = None
+        previous_key = get_latest(name) if name else None
+        if previous_key and has_index(previous_key):
+            base = load_index(previous_key, embeddings)
+        vectorstore = build(base)
+        save_index(key, vectorstore)
+    if name:
+        set_latest(name, key)
+    return vectorstore
@@ -0,0 +1,163 @@
+import os
+import queue
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils.ann import compact_index, to_flat
+from utils.index import chunk_ids
+
+
+READ_CHUNK_SIZE = 1024 * 1024
+EMBED_BATCH_SIZE = 64
+# unstructured 파싱은 CPU만 먹음 -> 파일별로 프로세스 나눠서 돌림. PARSE_WORKERS로 조절
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", os.cpu_count() or 1))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+# file.read()로 통째로 올리지 않고 1MB씩 디스크로 흘려보내면서 해시 계산
+def save_upload(file, folder):
+    os.makedirs(folder, exist_ok=True)
+    digest = hashlib.sha256()
+    tmp_path = os.path.join(folder, f".upload-{os.getpid()}-{threading.get_ident()}")
+    file.seek(0)
+    with open(tmp_path, "wb") as f:
+        while True:
+            chunk = file.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            f.write(chunk)
+    file_hash = digest.hexdigest()
+    file_path = os.path.join(folder, file_hash + os.path.splitext(file.name)[1])
+    os.replace(tmp_path, file_path)
+    return file_path, file_hash
+
+
+# paged 모드로 읽어서 페이지 단위로 split -> 다 끝날때까지 안기다리고 바로바로 yield
+def iter_split(file_path, splitter):
+    from langchain.document_loaders import UnstructuredFileLoader
+
+    loader = UnstructuredFileLoader(file_path, mode="paged")
+    for page in loader.load():
+        for doc in splitter.split_documents([page]):
+            yield doc
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # streamlit 서버는 스레드가 많아서 fork 말고 spawn
+            _executor = ProcessPoolExecutor(
+                max_workers=PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+def split_file(file_path, splitter_kwargs):
+    from langchain.text_splitter import CharacterTextSplitter
+
+    splitter = CharacterTextSplitter.from_tiktoken_encoder(**splitter_kwargs)
+    return list(iter_split(file_path, splitter))
+
+
+# 파일 여러개면 프로세스 풀에서 병렬로 파싱, 끝나는 순서대로 넘김
+def iter_split_files(file_paths, splitter_kwargs):
+    from langchain.text_splitter import CharacterTextSplitter
+
+    if len(file_paths) == 1 or PARSE_WORKERS <= 1:
+        splitter = CharacterTextSplitter.from_tiktoken_encoder(**splitter_kwargs)
+        for file_path in file_paths:
+            yield from iter_split(file_path, splitter)
+        return
+    futures = [
+        get_executor().submit(split_file, file_path, splitter_kwargs)
+        for file_path in file_paths
+    ]
+    try:
+        for future in as_completed(futures):
+            yield from future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+# split은 백그라운드 스레드에서 돌리고 여기서는 batch 단위로 embed -> 둘이 겹쳐서 돌아감
+# base가 있으면 새 청크만 embed해서 추가하고, 없어진 청크는 base에서 지움
+# 다 만들고 나서 크기에 맞는 ANN index로 바꿈 (utils/ann.py)
+# 만드는 동안은 float32 flat이라 최대 메모리는 청크수 x 차원 x 4바이트 (1M x 1536이면 ~6GB)
+def build_index(docs, embeddings, base=None, batch_size=EMBED_BATCH_SIZE):
+    from langchain.vectorstores import FAISS
+
+    batches = queue.Queue(maxsize=4)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    # embed 쪽이 실패하면(stop) split도 멈추고 docs를 닫음 -> 남은 파일 파싱 future가 취소됨
+    def produce():
+        chunks = chunk_ids(docs)
+        try:
+            batch = []
+            for chunk in chunks:
+                if stop.is_set():
+                    break
+                batch.append(chunk)
+                if len(batch) == batch_size:
+                    put(batch)
+                    batch = []
+            if batch:
+                put(batch)
+        except Exception as e:
+            put(e)
+        finally:
+            chunks.close()
+            if hasattr(docs, "close"):
+                docs.close()
+            put(None)
+
+    threading.Thread(target=produce, daemon=True).start()
+    if base is not None:
+        base = to_flat(base, embeddings)
+    vectorstore = base
+    existing_ids = set(base.index_to_docstore_id.values()) if base else set()
+    seen_ids = set()
+    try:
+        while True:
+            batch = batches.get()
+            if batch is None:
+                break
+            if isinstance(batch, Exception):
+                raise batch
+            seen_ids.update(id for id, _ in batch)
+            # 내용이 같아서 남기는 청크도 metadata(source, lastmod 등)는 새 문서걸로 바꿈
+            for id, doc in batch:
+                if id in existing_ids:
+                    vectorstore.docstore._dict[id] = doc
+            added = [(id, doc) for id, doc in batch if id not in existing_ids]
+            if not added:
+                continue
+            ids = [id for id, _ in added]
+            added_docs = [doc for _, doc in added]
+            if vectorstore is None:
+                vectorstore = FAISS.from_documents(added_docs, embeddings, ids=ids)
+            else:
+                vectorstore.add_documents(added_docs, ids=ids)
+    finally:
+        stop.set()
+    if not seen_ids:
+        raise ValueError("No text could be extracted from the file.")
+    removed_ids = existing_ids - seen_ids
+    if removed_ids:
+        vectorstore.delete(list(removed_ids))
+    return compact_index(vectorstore)
@@ -0,0 +1,105 @@
+import os
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from langchain.prompts import ChatPromptTemplate
+from langchain.schema import AIMessage, HumanMessage, SystemMessage
+from langchain.schema.output_parser import StrOutputParser
+from utils.context import get_encoding
+
+
+logger = logging.getLogger(__name__)
+
+MEMORY_TOKEN_LIMIT = int(os.environ.get("MEMORY_TOKEN_LIMIT", 1000))
+
+# 요약은 응답 경로 밖에서 돌림. 프로세스 전체에서 공유
+_summarizer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="memory-summary")
+
+summary_prompt = ChatPromptTemplate.from_template(
+    """
+    Progressively summarize the lines of conversation provided, adding onto the previous summary returning a new summary.
+    Keep it concise.
+
+    Current summary:
+    {summary}
+
+    New lines of conversation:
+    {lines}
+
+    New summary:
+    """
+)
+
+
+# 세션마다 하나씩 (st.session_state). 최근 대화는 토큰 한도 안에서 그대로 두고,
+# 밀려난 대화는 백그라운드에서 요약에 합침 -> 프롬프트 크기가 대화 길이랑 상관없이 일정
+class SummaryWindowMemory:
+    def __init__(self, llm, max_token_limit=MEMORY_TOKEN_LIMIT):
+        self.llm = llm
+        self.max_token_limit = max_token_limit
+        self.messages = deque()
+        self.tokens = 0
+        self.summary = ""
+        self.pending = []
+        self.future = None
+        self.lock = threading.Lock()
+
+    def save_context(self, question, answer):
+        encoding = get_encoding()
+        with self.lock:
+            for message in (HumanMessage(content=question), AIMessage(content=answer)):
+                tokens = len(encoding.encode(message.content))
+                self.messages.append((message, tokens))
+                self.tokens += tokens
+            # 마지막 한 턴(질문+답)은 항상 남김
+            while self.tokens > self.max_token_limit and len(self.messages) > 2:
+                message, tokens = self.messages.popleft()
+                self.tokens -= tokens
+                self.pending.append(message)
+            self.schedule()
+
+    # lock 잡고 불러야 함. 요약 중이면 summarize가 끝나기 전에 pending을 마저 가져감
+    def schedule(self):
+        if self.pending and self.future is None:
+            self.future = _summarizer.submit(self.summarize)
+
+    # 요약하는 동안 밀려난 대화도 pending이 빌때까지 이어서 요약
+    def summarize(self):
+        while True:
+            with self.lock:
+                if not self.pending:
+                    self.future = None
+                    return
+                pending, self.pending = self.pending, []
+                summary = self.summary
+            lines = "\n".join(
+                f"{'Human' if isinstance(message, HumanMessage) else 'AI'}: {message.content}"
+                for message in pending
+            )
+            try:
+                summary = (summary_prompt | self.llm | StrOutputParser()).invoke(
+                    {"summary": summary, "lines": lines}
+                )
+            except Exception:
+                logger.exception("Failed to summarize conversation")
+                # 다음 save_context때 다시 시도
+                with self.lock:
+                    self.pending = pending + self.pending
+                    self.future = None
+                return
+            with self.lock:
+                self.summary = summary.strip()
+
+    def is_empty(self):
+        with self.lock:
+            return not (self.messages or self.pending or self.summary)
+
+    def load_messages(self):
+        with self.lock:
+            history = [message for message, _ in self.messages]
+            if self.summary:
+                history.insert(
+                    0, SystemMessage(content=f"Summary of the earlier conversation: {self.summary}")
+                )
+        return history
@@ -0,0 +1,74 @@
+import os
+import numpy as np
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from langchain.schema.embeddings import Embeddings
+
+
+OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
+# 7B 채팅 모델로 embed하면 느림. `ollama pull nomic-embed-text` 하고
+# OLLAMA_EMBED_MODEL=nomic-embed-text 주면 CPU에서도 훨씬 빠름 (인덱스는 모델별로 따로 만들어짐)
+OLLAMA_EMBED_MODEL = os.environ.get("OLLAMA_EMBED_MODEL", "mistral:latest")
+OLLAMA_EMBED_BATCH_SIZE = int(os.environ.get("OLLAMA_EMBED_BATCH_SIZE", 16))
+OLLAMA_EMBED_CONCURRENCY = int(os.environ.get("OLLAMA_EMBED_CONCURRENCY", 4))
+
+
+def normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    return (vector / (np.linalg.norm(vector) or 1.0)).tolist()
+
+
+# langchain OllamaEmbeddings는 청크 하나당 요청 하나를 순서대로 보냄
+# -> 배치(/api/embed)로 묶고, 커넥션 풀 하나로 동시에 몇개씩 보냄
+# 예전 ollama라 /api/embed가 없으면(404) 청크별 /api/embeddings로 내려감
+# /api/embed는 정규화된 벡터를 돌려줘서 예전 엔드포인트 결과도 정규화해서 맞춤
+class OllamaBatchEmbeddings(Embeddings):
+    def __init__(
+        self,
+        model=OLLAMA_EMBED_MODEL,
+        base_url=OLLAMA_BASE_URL,
+        batch_size=OLLAMA_EMBED_BATCH_SIZE,
+        concurrency=OLLAMA_EMBED_CONCURRENCY,
+        timeout=120,
+    ):
+        self.model = model
+        self.base_url = base_url.rstrip("/")
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.batch_endpoint = True
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=concurrency,
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504], allowed_methods=None),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(concurrency, thread_name_prefix="ollama-embed")
+
+    def _post(self, path, payload):
+        response = self.session.post(f"{self.base_url}{path}", json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def _embed_batch(self, texts):
+        if self.batch_endpoint:
+            try:
+                return self._post("/api/embed", {"model": self.model, "input": texts})["embeddings"]
+            except requests.HTTPError as e:
+                if e.response.status_code != 404 or "model" in e.response.text:
+                    raise
+                self.batch_endpoint = False
+        return [
+            normalize(self._post("/api/embeddings", {"model": self.model, "prompt": text})["embedding"])
+            for text in texts
+        ]
+
+    def embed_documents(self, texts):
+        batches = [texts[i : i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        return [vector for vectors in self.executor.map(self._embed_batch, batches) for vector in vectors]
+
+    def embed_query(self, text):
+        return self._embed_batch([text])[0]
@@ -0,0 +1,242 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import threading
+from utils.context import get_encoding
+from utils.runner import iterate, run
+from utils.stores import CACHE_DIR
+
+
+logger = logging.getLogger(__name__)
+
+
+QUIZ_CACHE_SIZE = int(os.environ.get("QUIZ_CACHE_SIZE", 500))
+QUIZ_CACHE_TTL = int(os.environ.get("QUIZ_CACHE_TTL", 60 * 60 * 24 * 30))
+QUIZ_QUESTIONS = 5
+# 이것보다 긴 문서는 청크 묶음마다 따로 문제를 만들고(map) 합쳐서 고름(reduce)
+QUIZ_GROUP_TOKENS = int(os.environ.get("QUIZ_GROUP_TOKENS", 3000))
+QUIZ_MAP_CONCURRENCY = int(os.environ.get("QUIZ_MAP_CONCURRENCY", 8))
+# 묶음이 이보다 많으면 문서 전체에서 고르게 뽑음 -> 문서가 커져도 LLM 호출 수/시간이 안늘어남
+QUIZ_MAX_GROUPS = int(os.environ.get("QUIZ_MAX_GROUPS", 8))
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+# 퀴즈 키 = 문서 내용 해시 + 프롬프트/모델 버전
+# -> 같은 이름인데 내용이 바뀐 파일은 새로 만들고, 프롬프트 고치면 예전 퀴즈 안씀
+def quiz_key(docs, version):
+    digest = hashlib.sha256(version.encode())
+    for doc in docs:
+        digest.update(b"\0")
+        digest.update(doc.page_content.encode())
+    return digest.hexdigest()
+
+
+# 서버 재시작해도 남는 퀴즈 캐시. 오래 안쓴것부터 지우고(LRU) ttl 지난것도 지움
+class QuizCache:
+    def __init__(self, path, max_entries=QUIZ_CACHE_SIZE, ttl=QUIZ_CACHE_TTL):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS quizzes "
+            "(key TEXT PRIMARY KEY, quiz TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT quiz FROM quizzes WHERE key = ? AND created > ?", (key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE quizzes SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, quiz):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO quizzes (key, quiz, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(quiz), now, now),
+            )
+            self.conn.execute("DELETE FROM quizzes WHERE created <= ?", (now - self.ttl,))
+            self.conn.execute(
+                "DELETE FROM quizzes WHERE key NOT IN "
+                "(SELECT key FROM quizzes ORDER BY accessed DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+
+def get_quiz_cache(path=f"{CACHE_DIR}/quizzes.sqlite"):
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = QuizCache(path)
+        return _caches[path]
+
+
+# 순서대로 토큰 예산만큼씩 청크를 묶음
+def group_docs(docs, max_tokens=QUIZ_GROUP_TOKENS):
+    encoding = get_encoding()
+    groups = [[]]
+    used = 0
+    for doc in docs:
+        tokens = len(encoding.encode(doc.page_content))
+        if groups[-1] and used + tokens > max_tokens:
+            groups.append([])
+            used = 0
+        groups[-1].append(doc)
+        used += tokens
+    return groups
+
+
+def sample_groups(groups, count=QUIZ_MAX_GROUPS):
+    if len(groups) <= count:
+        return groups
+    step = len(groups) / count
+    return [groups[int(i * step)] for i in range(count)]
+
+
+# 모델이 "answers": ["a", "b"]나 "correct": "true"처럼 모양을 틀리게 줄때도 안터지고 걸러냄
+def is_valid_question(question):
+    if not isinstance(question, dict):
+        return False
+    answers = question.get("answers")
+    return (
+        isinstance(question.get("question"), str)
+        and isinstance(answers, list)
+        and len(answers) >= 2
+        and all(
+            isinstance(answer, dict)
+            and isinstance(answer.get("answer"), str)
+            and isinstance(answer.get("correct"), bool)
+            for answer in answers
+        )
+        and sum(answer["correct"] for answer in answers) == 1
+    )
+
+
+def question_words(question):
+    return set(re.findall(r"\w+", question["question"].lower()))
+
+
+# 묶음별 후보에서 형식이 이상한거랑 (거의) 같은 질문을 빼고
+# 문서 전체에 고르게 퍼진 묶음부터 돌아가면서 하나씩 뽑음 -> 앞부분만 나오지 않게
+def select_questions(candidates, count=QUIZ_QUESTIONS, max_similarity=0.8):
+    spread = dict.fromkeys(int(i * len(candidates) / count) for i in range(count))
+    order = [*spread, *(i for i in range(len(candidates)) if i not in spread)]
+    queues = [[q for q in candidates[i] if is_valid_question(q)] for i in order]
+    selected = []
+    seen = []
+    while len(selected) < count and any(queues):
+        for queue in queues:
+            if not queue or len(selected) == count:
+                continue
+            question = queue.pop(0)
+            words = question_words(question)
+            if any(len(words & other) / (len(words | other) or 1) >= max_similarity for other in seen):
+                continue
+            selected.append(question)
+            seen.append(words)
+    return selected
+
+
+# 스트리밍 중인 JSON 텍스트에서 {"questions": [...]} 배열 안의 객체가 닫힐때마다 하나씩 꺼냄
+# 앞뒤 ```json 같은 불순물은 괄호 밖이라 무시됨
+class QuestionStreamParser:
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.array_depth = None
+        self.start = None
+
+    def feed(self, text):
+        self.buffer += text
+        questions = []
+        for position in range(self.position, len(self.buffer)):
+            char = self.buffer[position]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.depth += 1
+                if char == "[" and self.array_depth is None and self.depth == 2:
+                    self.array_depth = self.depth
+                elif char == "{" and self.array_depth is not None and self.depth == self.array_depth + 1:
+                    self.start = position
+            elif char in "}]":
+                if char == "}" and self.start is not None and self.depth == self.array_depth + 1:
+                    text = self.buffer[self.start : position + 1]
+                    try:
+                        question = json.loads(text)
+                    except ValueError:
+                        # 끝에 쉼표 같은 깨진 JSON은 그 질문만 버림
+                        logger.warning("skipping malformed quiz question: %s", text)
+                    else:
+                        if is_valid_question(question):
+                            questions.append(question)
+                    self.start = None
+                self.depth -= 1
+        self.position = len(self.buffer)
+        return questions
+
+
+def parse_questions(text):
+    return QuestionStreamParser().feed(text)
+
+
+async def map_questions(chain, groups, text, concurrency=QUIZ_MAP_CONCURRENCY):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def generate(docs):
+        async with semaphore:
+            try:
+                return parse_questions(text(await chain.ainvoke(docs)))
+            except Exception:
+                # 한 묶음이 실패해도 나머지로 퀴즈를 만듦
+                logger.exception("quiz generation failed for a chunk group")
+                return []
+
+    return await asyncio.gather(*[generate(docs) for docs in groups])
+
+
+# chain: docs -> 메시지, text: 메시지(청크) -> JSON 텍스트
+# 짧은 문서는 한번 호출을 스트리밍하면서 질문이 완성될때마다 바로 내보내고
+# 긴 문서는 묶음마다 동시에 만들고(map) 합쳐서 고름(reduce)
+def generate_quiz(chain, docs, text, count=QUIZ_QUESTIONS):
+    groups = group_docs(docs)
+    if len(groups) == 1:
+        parser = QuestionStreamParser()
+        generated = False
+        for chunk in iterate(chain.astream(docs)):
+            for question in parser.feed(text(chunk)):
+                generated = True
+                yield question
+        if not generated:
+            raise ValueError("could not generate any quiz questions")
+        return
+    candidates = run(map_questions(chain, sample_groups(groups), text))
+    questions = select_questions(candidates, count)
+    if not questions:
+        raise ValueError("could not generate any quiz questions")
+    yield from questions
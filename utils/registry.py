@@ -0,0 +1,152 @@
+import os
+import sys
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict
+from langchain.schema import BaseRetriever
+from utils.ann import INDEX_MEMORY_BUDGET, index_bytes
+from utils.index import has_index, load_index, save_index
+
+
+logger = logging.getLogger(__name__)
+
+# 모든 페이지 인덱스 합쳐서 이만큼만 메모리에 둠. 넘으면 제일 오래 안쓴것부터 내림
+# 기본값은 ANN 예산(INDEX_MEMORY_BUDGET_MB)의 2배 -> 예산 꽉 채운 인덱스 하나가 올라와도 나머지가 다 안내려감
+REGISTRY_MEMORY_BUDGET = (
+    int(os.environ.get("INDEX_REGISTRY_BUDGET_MB", 2 * INDEX_MEMORY_BUDGET // 2**20)) * 1024 * 1024
+)
+# Document 객체 + __dict__ + docstore/index_to_docstore_id 항목 (본문, id, metadata 값은 따로 셈)
+DOCUMENT_OVERHEAD = 700
+
+# key -> (vectorstore, nbytes), 뒤에 있을수록 최근에 씀
+_indexes = OrderedDict()
+# 내려간 인덱스를 다시 열때 쓸 embedding. 키만 남기고 인덱스는 디스크에
+_embeddings = {}
+_total_bytes = 0
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_lock = threading.Lock()
+# key -> 디스크에서 다시 여는 중일때 잡는 lock
+_load_locks = {}
+
+
+if REGISTRY_MEMORY_BUDGET < INDEX_MEMORY_BUDGET:
+    logger.warning(
+        "INDEX_REGISTRY_BUDGET_MB is smaller than INDEX_MEMORY_BUDGET_MB: "
+        "one large index will evict every other index each time it is loaded"
+    )
+
+
+def document_bytes(id, doc):
+    return (
+        sys.getsizeof(id)
+        + sys.getsizeof(doc.page_content)
+        + sys.getsizeof(doc.metadata)
+        + sum(sys.getsizeof(value) for value in doc.metadata.values())
+        + DOCUMENT_OVERHEAD
+    )
+
+
+# 인덱스 + docstore가 파이썬 메모리에서 차지하는 크기 추정
+def vectorstore_bytes(vectorstore):
+    docs = sum(document_bytes(id, doc) for id, doc in vectorstore.docstore._dict.items())
+    return index_bytes(vectorstore.index) + docs
+
+
+def _insert(key, vectorstore):
+    global _total_bytes
+    nbytes = vectorstore_bytes(vectorstore)
+    with _lock:
+        if key in _indexes:
+            _total_bytes -= _indexes.pop(key)[1]
+        _indexes[key] = (vectorstore, nbytes)
+        _total_bytes += nbytes
+        # 방금 넣은건 예산보다 커도 남김
+        while _total_bytes > REGISTRY_MEMORY_BUDGET and len(_indexes) > 1:
+            evicted, (_, evicted_bytes) = _indexes.popitem(last=False)
+            _total_bytes -= evicted_bytes
+            _stats["evictions"] += 1
+            logger.info("evicted index %s (%d bytes)", evicted, evicted_bytes)
+
+
+# 프로세스에 인덱스 하나씩만 두고 세션들은 키로 같이 씀
+# 디스크에 없으면 먼저 저장 -> 내려가도 나중에 디스크에서 다시 열 수 있게
+def register(key, vectorstore):
+    if not has_index(key):
+        save_index(key, vectorstore)
+    _embeddings[key] = vectorstore.embedding_function
+    _insert(key, vectorstore)
+    return IndexRetriever(key=key)
+
+
+def _cached(key):
+    with _lock:
+        if key in _indexes:
+            _indexes.move_to_end(key)
+            return _indexes[key][0]
+    return None
+
+
+def get_index(key):
+    with _lock:
+        if key in _indexes:
+            _indexes.move_to_end(key)
+            _stats["hits"] += 1
+            return _indexes[key][0]
+        _stats["misses"] += 1
+        load_lock = _load_locks.setdefault(key, threading.Lock())
+    if key not in _embeddings:
+        raise KeyError(f"index {key!r} is not registered")
+    # 다시 열면 인덱스랑 docstore를 통째로 읽음 -> 같은 키는 한 스레드만 읽고 나머지는 기다렸다가 씀
+    with load_lock:
+        vectorstore = _cached(key)
+        if vectorstore is None:
+            vectorstore = load_index(key, _embeddings[key])
+            _insert(key, vectorstore)
+    return vectorstore
+
+
+# 이벤트 루프에서는 이걸로. 내려간 인덱스를 다시 여는 디스크 I/O, unpickle이
+# 공유 루프를 막으면 모든 세션 스트리밍이 멈춤 -> 스레드에서 함
+async def aget_index(key):
+    return await asyncio.to_thread(get_index, key)
+
+
+def stats():
+    with _lock:
+        return {
+            **_stats,
+            "indexes": len(_indexes),
+            "bytes": _total_bytes,
+            "budget": REGISTRY_MEMORY_BUDGET,
+        }
+
+
+# st.cache_data는 리턴값을 pickle해서 hit마다 복사함 -> FAISS 인덱스 통째로 복사되고
+# Ollama 객체는 pickle도 안됨. 그래서 키만 들고 있는 retriever를 돌려줌
+class IndexRetriever(BaseRetriever):
+    key: str
+    search_kwargs: Dict[str, Any] = {}
+
+    @property
+    def vectorstore(self):
+        return get_index(self.key)
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        return self.vectorstore.similarity_search(query, **self.search_kwargs)
+
+    async def avectorstore(self):
+        return await aget_index(self.key)
+
+    async def _aget_relevant_documents(self, query, *, run_manager):
+        vectorstore = await self.avectorstore()
+        return await vectorstore.asimilarity_search(query, **self.search_kwargs)
+
+    # 이미 embed한 질문으로 검색
+    def search_by_vector(self, vector):
+        return self.vectorstore.similarity_search_by_vector(vector, **self.search_kwargs)
+
+    async def asearch_by_vector(self, vector):
+        vectorstore = await self.avectorstore()
+        return await vectorstore.asimilarity_search_by_vector(vector, **self.search_kwargs)
@@ -0,0 +1,63 @@
+import queue
+import asyncio
+import threading
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+# 모든 세션이 같이 쓰는 이벤트 루프 하나. 체인은 여기서 ainvoke/astream으로 돌고
+# 스크립트 스레드는 결과만 기다림 -> LLM 네트워크 대기가 세션끼리 겹쳐서 돌아감
+def get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="chain-loop", daemon=True).start()
+        return _loop
+
+
+# run_coroutine_threadsafe는 호출한 스레드의 contextvars를 복사해서 넘김
+# -> get_openai_callback() 같은 것도 그대로 동작
+def run(coro, timeout=None):
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
+
+
+class _Error:
+    def __init__(self, error):
+        self.error = error
+
+
+_DONE = object()
+
+
+# astream 결과를 스크립트 스레드에서 for문으로 받을 수 있게 queue로 넘김
+def iterate(async_iterable):
+    items = queue.Queue()
+
+    async def pump():
+        try:
+            async for item in async_iterable:
+                items.put(item)
+        except Exception as e:
+            items.put(_Error(e))
+        finally:
+            items.put(_DONE)
+
+    future = asyncio.run_coroutine_threadsafe(pump(), get_loop())
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _Error):
+                raise item.error
+            yield item
+    finally:
+        future.cancel()
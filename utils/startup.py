@@ -0,0 +1,77 @@
+import os
+import sys
+import glob
+import time
+import argparse
+import subprocess
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_BUDGET = float(os.environ.get("IMPORT_BUDGET_SECONDS", 3.0))
+PAGES = ["Home.py", *sorted(glob.glob("pages/*.py", root_dir=ROOT))]
+
+
+# 페이지 최상단 코드를 통째로 돌림 (streamlit bare mode, 위젯은 기본값)
+# import만 보면 최상단에서 부르는 get_chains() 같은 함수 안 import를 놓침
+# 함수 안 import는 그 함수가 처음 그릴때 불리지 않으면 여기 안잡힘
+def page_code(path):
+    return f"import runpy; runpy.run_path({path!r}, run_name='__main__')"
+
+
+# 새 프로세스에서 -X importtime으로 돌려야 다른 페이지가 이미 불러온 모듈 영향이 없음
+# stderr 한줄: "import time: self [us] | cumulative | imported package"
+def profile(path):
+    code = page_code(path)
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - start
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue
+        modules.append((int(self_us), int(cumulative_us), name.strip()))
+    return {
+        "path": path,
+        "seconds": elapsed,
+        "modules": modules,
+        "error": result.stderr.strip().splitlines()[-1] if result.returncode else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="페이지별 콜드스타트 import 시간 측정 (python -m utils.startup)"
+    )
+    parser.add_argument("paths", nargs="*", default=PAGES)
+    parser.add_argument("--budget", type=float, default=IMPORT_BUDGET)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    over_budget = []
+    for path in args.paths:
+        report = profile(path)
+        flag = "OVER" if report["seconds"] > args.budget else "ok"
+        print(f"{report['path']}: {report['seconds']:.2f}s [{flag}]")
+        if report["error"]:
+            print(f"  import failed: {report['error']}")
+        for self_us, cumulative_us, name in sorted(report["modules"], reverse=True)[: args.top]:
+            print(f"  {self_us / 1e6:7.3f}s self {cumulative_us / 1e6:7.3f}s total  {name}")
+        if report["seconds"] > args.budget:
+            over_budget.append(path)
+
+    if over_budget:
+        print(f"over {args.budget:.2f}s budget: {', '.join(over_budget)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+import os
+import re
+import sqlite3
+import hashlib
+import threading
+from array import array
+from langchain.schema import BaseStore
+
+
+CACHE_DIR = "./.cache"
+# sqlite: db 파일 하나에 다 넣음 / file: 예전처럼 청크마다 파일 하나 (LocalFileStore)
+EMBEDDING_STORE = os.environ.get("EMBEDDING_STORE", "sqlite")
+# sqlite 바인딩 변수 개수 제한(999) 안넘게 나눠서 조회
+SQLITE_BATCH_SIZE = 900
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class SQLiteStore(BaseStore[str, bytes]):
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL) WITHOUT ROWID"
+        )
+        self.conn.commit()
+
+    def mget(self, keys):
+        keys = list(keys)
+        found = {}
+        with self.lock:
+            for i in range(0, len(keys), SQLITE_BATCH_SIZE):
+                batch = keys[i : i + SQLITE_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                found.update(
+                    self.conn.execute(
+                        f"SELECT key, value FROM kv WHERE key IN ({placeholders})", batch
+                    )
+                )
+        return [found.get(key) for key in keys]
+
+    def mset(self, key_value_pairs):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", key_value_pairs
+            )
+
+    def mdelete(self, keys):
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM kv WHERE key = ?", [(key,) for key in keys])
+
+    def yield_keys(self, prefix=None):
+        with self.lock:
+            if prefix:
+                rows = self.conn.execute(
+                    "SELECT key FROM kv WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+                ).fetchall()
+            else:
+                rows = self.conn.execute("SELECT key FROM kv").fetchall()
+        for (key,) in rows:
+            yield key
+
+
+# 같은 db 파일은 프로세스에서 연결 하나만 씀
+def get_sqlite_store(path):
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = SQLiteStore(path)
+        return _stores[path]
+
+
+### json 대신 float32 바이트로 저장 -> 1536차원 기준 ~30KB -> 6KB
+def encode_vector(vector):
+    return array("f", vector).tobytes()
+
+
+def decode_vector(data):
+    vector = array("f")
+    vector.frombytes(data)
+    return vector.tolist()
+
+
+# LocalFileStore 키는 [a-zA-Z0-9_.-/]만 됨 -> "mistral:latest"의 ":" 같은건 "_"로
+# 구분자는 "/" (file이면 모델별 폴더가 됨)
+def embedding_namespace(embedder):
+    model = re.sub(r"[^a-zA-Z0-9_.\-]", "_", str(getattr(embedder, "model", "") or ""))
+    return f"{type(embedder).__name__}/{model or 'default'}/"
+
+
+# 모든 페이지가 같은 캐시를 씀. key = 모델 namespace + 청크 내용 해시
+# -> 파일이 달라도 같은 문단이면 한번만 embed
+def cache_embeddings(embedder):
+    from langchain.storage import EncoderBackedStore, LocalFileStore
+    from langchain.embeddings import CacheBackedEmbeddings
+
+    namespace = embedding_namespace(embedder)
+    if EMBEDDING_STORE == "file":
+        store = LocalFileStore(f"{CACHE_DIR}/embedding_cache")
+        return CacheBackedEmbeddings.from_bytes_store(embedder, store, namespace=namespace)
+    store = get_sqlite_store(f"{CACHE_DIR}/embeddings.sqlite")
+    return CacheBackedEmbeddings(
+        embedder,
+        EncoderBackedStore(
+            store,
+            lambda text: namespace + hashlib.sha256(text.encode()).hexdigest(),
+            encode_vector,
+            decode_vector,
+        ),
+    )
@@ -0,0 +1,232 @@
+import os
+import re
+import bz2
+import sys
+import gzip
+import json
+import zlib
+import sqlite3
+import argparse
+from xml.etree.ElementTree import iterparse
+from langchain.schema import BaseRetriever, Document
+from utils.stores import CACHE_DIR
+
+
+# 덤프로 만든 로컬 위키피디아. 없으면 WikipediaRetriever(인터넷)로 감
+WIKI_INDEX_PATH = os.environ.get("WIKI_INDEX_PATH", f"{CACHE_DIR}/wikipedia.sqlite")
+WIKI_URL = os.environ.get("WIKI_URL", "https://en.wikipedia.org/wiki/")
+WIKI_BATCH_SIZE = 1000
+
+
+def open_dump(path):
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+### mwparserfromhell 없이 대충 평문으로. 템플릿/표/ref/파일링크 빼고 [[링크|글자]] -> 글자
+def strip_wikitext(text):
+    text = re.sub(r"<!--.*?-->", "", text, flags=re.S)
+    text = re.sub(r"<ref[^>]*/>|<ref[^>]*>.*?</ref>", "", text, flags=re.S)
+    # 중첩된 {{ }}, {| |}는 안쪽부터 여러번 지움
+    previous = None
+    while previous != text:
+        previous = text
+        text = re.sub(r"\{\{[^{}]*\}\}", "", text)
+        text = re.sub(r"\{\|[^{}]*?\|\}", "", text, flags=re.S)
+    text = re.sub(r"\[\[(?:File|Image|Category):[^\[\]]*(?:\[\[[^\]]*\]\][^\[\]]*)*\]\]", "", text, flags=re.I)
+    text = re.sub(r"\[\[(?:[^|\]]*\|)?([^\]]*)\]\]", r"\1", text)
+    text = re.sub(r"\[https?://[^\s\]]+ ?([^\]]*)\]", r"\1", text)
+    text = re.sub(r"<[^>]+>", "", text)
+    text = re.sub(r"'{2,}", "", text)
+    text = re.sub(r"^=+\s*(.*?)\s*=+\s*$", r"\1", text, flags=re.M)
+    text = re.sub(r"^[*#:;]+\s*", "", text, flags=re.M)
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip()
+
+
+# MediaWiki XML 덤프(pages-articles.xml.bz2)에서 본문(ns=0) 문서만, 리다이렉트 빼고
+def iter_xml_articles(path):
+    title = namespace = text = None
+    redirect = False
+    root = None
+    with open_dump(path) as f:
+        for event, element in iterparse(f, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = element
+                continue
+            tag = element.tag.rsplit("}", 1)[-1]
+            if tag == "title":
+                title = element.text
+            elif tag == "ns":
+                namespace = element.text
+            elif tag == "redirect":
+                redirect = True
+            elif tag == "text":
+                text = element.text or ""
+            elif tag == "page":
+                if namespace == "0" and not redirect and title:
+                    yield title, strip_wikitext(text or "")
+                title = namespace = text = None
+                redirect = False
+                # 다 읽은 page는 버려야 메모리가 안늘어남
+                # clear만 하면 빈 page가 root(<mediawiki>)에 계속 붙어있음 -> root도 비움
+                element.clear()
+                root.clear()
+
+
+# wikiextractor --json 이나 {"title", "text"} jsonl 덤프 (이미 평문)
+def iter_json_articles(path):
+    with open_dump(path) as f:
+        for line in f:
+            if line.strip():
+                article = json.loads(line)
+                yield article["title"], article["text"]
+
+
+def iter_articles(path):
+    if ".json" in os.path.basename(path):
+        return iter_json_articles(path)
+    return iter_xml_articles(path)
+
+
+# 본문은 zlib으로 압축해서 articles에, 검색은 FTS5(내용은 안들고 있는 contentless)로
+def build_wiki_index(dump_path, path=WIKI_INDEX_PATH, limit=None):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute(
+        "CREATE TABLE articles (id INTEGER PRIMARY KEY, title TEXT NOT NULL COLLATE NOCASE, text BLOB NOT NULL)"
+    )
+    conn.execute("CREATE INDEX articles_title ON articles (title)")
+    conn.execute(
+        "CREATE VIRTUAL TABLE articles_fts USING fts5(title, body, content='', tokenize='porter unicode61')"
+    )
+    count = 0
+    batch = []
+
+    def flush():
+        conn.executemany("INSERT INTO articles (id, title, text) VALUES (?, ?, ?)", [
+            (row_id, title, zlib.compress(text.encode("utf-8"))) for row_id, title, text in batch
+        ])
+        conn.executemany("INSERT INTO articles_fts (rowid, title, body) VALUES (?, ?, ?)", batch)
+        conn.commit()
+        batch.clear()
+
+    for title, text in iter_articles(dump_path):
+        if not text:
+            continue
+        count += 1
+        batch.append((count, title, text))
+        if len(batch) >= WIKI_BATCH_SIZE:
+            flush()
+        if limit and count >= limit:
+            break
+    flush()
+    conn.execute("INSERT INTO articles_fts (articles_fts) VALUES ('optimize')")
+    conn.commit()
+    conn.close()
+    os.replace(tmp_path, path)
+    return count
+
+
+def has_wiki_index(path=WIKI_INDEX_PATH):
+    return os.path.exists(path)
+
+
+# 검색어를 FTS5 문법으로. 단어마다 따옴표로 감싸서 특수문자(-, :, *) 때문에 안터지게
+def fts_query(query, operator=" "):
+    words = re.findall(r"\w+", query)
+    return operator.join(f'"{word}"' for word in words)
+
+
+def summarize(text):
+    return text.split("\n\n", 1)[0]
+
+
+# WikipediaRetriever랑 같은 모양의 Document를 돌려줌 (metadata: title, summary, source)
+# 제목이 정확히 같은 문서 -> 단어 전부 포함(AND) -> 하나라도 포함(OR) 순으로 찾고
+# 로컬 인덱스가 없거나 아무것도 못찾으면 인터넷 WikipediaRetriever로
+class LocalWikipediaRetriever(BaseRetriever):
+    path: str = WIKI_INDEX_PATH
+    top_k_results: int = 3
+    doc_content_chars_max: int = 4000
+    fallback_to_api: bool = True
+
+    def search(self, query):
+        if not has_wiki_index(self.path):
+            return []
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        try:
+            ids = [row[0] for row in conn.execute("SELECT id FROM articles WHERE title = ?", (query.strip(),))]
+            for operator in (" ", " OR "):
+                match = fts_query(query, operator)
+                if len(ids) >= self.top_k_results or not match:
+                    break
+                ids += [
+                    row[0]
+                    for row in conn.execute(
+                        "SELECT rowid FROM articles_fts WHERE articles_fts MATCH ? "
+                        "ORDER BY bm25(articles_fts, 10.0, 1.0) LIMIT ?",
+                        (match, self.top_k_results),
+                    )
+                    if row[0] not in ids
+                ]
+            ids = ids[: self.top_k_results]
+            placeholders = ",".join("?" * len(ids))
+            rows = dict(
+                (row[0], row[1:])
+                for row in conn.execute(f"SELECT id, title, text FROM articles WHERE id IN ({placeholders})", ids)
+            )
+        finally:
+            conn.close()
+        docs = []
+        for row_id in ids:
+            title, data = rows[row_id]
+            text = zlib.decompress(data).decode("utf-8")
+            docs.append(
+                Document(
+                    page_content=text[: self.doc_content_chars_max],
+                    metadata={
+                        "title": title,
+                        "summary": summarize(text),
+                        "source": WIKI_URL + title.replace(" ", "_"),
+                    },
+                )
+            )
+        return docs
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        docs = self.search(query)
+        if not docs and self.fallback_to_api:
+            # langchain.retrievers는 import가 무거워서 필요할때만
+            from langchain.retrievers import WikipediaRetriever
+
+            retriever = WikipediaRetriever(
+                top_k_results=self.top_k_results,
+                doc_content_chars_max=self.doc_content_chars_max,
+            )
+            return retriever.get_relevant_documents(query)
+        return docs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="위키피디아 덤프로 로컬 검색 인덱스 만들기 (python -m utils.wiki)")
+    parser.add_argument("dump", help="pages-articles.xml(.bz2) 또는 {title, text} jsonl(.gz/.bz2)")
+    parser.add_argument("--output", default=WIKI_INDEX_PATH)
+    parser.add_argument("--limit", type=int)
+    args = parser.parse_args(argv)
+    count = build_wiki_index(args.dump, args.output, args.limit)
+    print(f"indexed {count} articles into {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())